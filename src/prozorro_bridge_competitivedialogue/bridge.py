@@ -8,11 +8,25 @@ from prozorro_bridge_competitivedialogue.settings import (
     ALLOWED_STATUSES,
     REWRITE_STATUSES,
     STAGE2_STATUS,
+    SLOW_CALLBACK_THRESHOLD,
+    DRY_RUN,
+)
+from prozorro_bridge_competitivedialogue import dead_letter, credentials_cache, shutdown
+from prozorro_bridge_competitivedialogue.models import Tender
+from prozorro_bridge_competitivedialogue.monitoring import INFLIGHT, step_timer, track_dialogue
+from prozorro_bridge_competitivedialogue.tracing import (
+    traced,
+    start_span,
+    set_span_attribute,
+    record_response,
+    record_retry,
 )
 from prozorro_bridge_competitivedialogue.utils import (
     journal_context,
     check_tender,
     prepare_new_tender_data,
+    encode_body,
+    count_bytes,
     BASE_URL,
     HEADERS,
 )
@@ -35,7 +49,18 @@ from prozorro_bridge_competitivedialogue.journal_msg_ids import (
 )
 
 
+def record_exchange(operation: str, response, body: str, request_body: bytes = b"") -> None:
+    """Response metrics, they must never fail the request and send it to the retry loop"""
+    try:
+        record_response(response.status)
+        count_bytes(operation, response, body, request_body)
+    except Exception as e:
+        LOGGER.warning(f"Can't record {operation} response metrics: {e}")
+
+
+@traced("get_tender_credentials")
 async def get_tender_credentials(tender_id: str, session: ClientSession) -> dict:
+    set_span_attribute("tender.id", tender_id)
     url = f"{BASE_URL}/tenders/{tender_id}/extract_credentials"
     while True:
         LOGGER.info(
@@ -48,6 +73,7 @@ async def get_tender_credentials(tender_id: str, session: ClientSession) -> dict
         try:
             response = await session.get(url, headers=HEADERS)
             data = await response.text()
+            record_exchange("get_tender_credentials", response, data)
             if response.status == 200:
                 data = json.loads(data)
                 LOGGER.info(
@@ -68,19 +94,24 @@ async def get_tender_credentials(tender_id: str, session: ClientSession) -> dict
                 ),
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
 
 
+@traced("get_tender")
 async def get_tender(tender_id: str, session: ClientSession) -> dict:
+    set_span_attribute("tender.id", tender_id)
     while True:
         try:
             response = await session.get(f"{BASE_URL}/tenders/{tender_id}", headers=HEADERS)
             data = await response.text()
+            record_exchange("get_tender", response, data)
             if response.status == 404:
                 return {}
             elif response.status != 200:
                 raise ConnectionError(f"Error {data}")
-            return json.loads(data)["data"]
+            with step_timer("parse_tender", tender_id, threshold=SLOW_CALLBACK_THRESHOLD):
+                return json.loads(data)["data"]
         except Exception as e:
             LOGGER.warning(
                 f"Fail to get tender {tender_id}",
@@ -90,6 +121,7 @@ async def get_tender(tender_id: str, session: ClientSession) -> dict:
                 )
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
 
 
@@ -126,8 +158,14 @@ async def check_second_stage_tender(tender: dict, session: ClientSession) -> boo
     return True
 
 
+@traced("create_tender_stage2")
 async def create_tender_stage2(new_tender: dict, session: ClientSession) -> dict:
+    set_span_attribute("tender.id", new_tender["dialogueID"])
     url = f"{BASE_URL}/tenders"
+    if DRY_RUN:
+        from prozorro_bridge_competitivedialogue import dry_run
+        return dry_run.record_create(new_tender, url)
+    request = encode_body(new_tender)
     while True:
         LOGGER.info(
             f"Creating tender stage2 from competitive dialogue id={new_tender['dialogueID']}",
@@ -136,8 +174,9 @@ async def create_tender_stage2(new_tender: dict, session: ClientSession) -> dict
                 {"TENDER_ID": new_tender["dialogueID"]})
         )
         try:
-            response = await session.post(url, json={"data": new_tender}, headers=HEADERS)
+            response = await session.post(url, **request)
             data = await response.text()
+            record_exchange("create_tender_stage2", response, data, request["data"])
             if response.status in (422, 404):
                 LOGGER.warning(
                     f"Catch {response.status} status, stop create tender stage2",
@@ -163,6 +202,7 @@ async def create_tender_stage2(new_tender: dict, session: ClientSession) -> dict
                 )
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
         else:
             tender = json.loads(data)["data"]
@@ -178,8 +218,14 @@ async def create_tender_stage2(new_tender: dict, session: ClientSession) -> dict
             return dialog
 
 
+@traced("patch_dialog_add_stage2_id")
 async def patch_dialog_add_stage2_id(dialog: dict, session: ClientSession) -> None:
+    set_span_attribute("tender.id", dialog["id"])
     url = f"{BASE_URL}/tenders/{dialog['id']}"
+    if DRY_RUN:
+        from prozorro_bridge_competitivedialogue import dry_run
+        return dry_run.record_intent(dialog["id"], "patch_dialog_add_stage2_id", "PATCH", url, {"data": dialog})
+    request = encode_body(dialog)
     while True:
         LOGGER.info(
             f"Patch competitive dialogue id={dialog['id']} with stage2 tender id",
@@ -189,9 +235,11 @@ async def patch_dialog_add_stage2_id(dialog: dict, session: ClientSession) -> No
             )
         )
         try:
-            response = await session.patch(url, json={"data": dialog}, headers=HEADERS)
+            response = await session.patch(url, **request)
             data = await response.text()
+            record_exchange("patch_dialog_add_stage2_id", response, data, request["data"])
             if response.status == 412:
+                record_retry()
                 continue
             elif response.status != 200:
                 LOGGER.info(
@@ -210,6 +258,7 @@ async def patch_dialog_add_stage2_id(dialog: dict, session: ClientSession) -> No
                 )
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
         else:
             data = json.loads(data)["data"]
@@ -223,13 +272,19 @@ async def patch_dialog_add_stage2_id(dialog: dict, session: ClientSession) -> No
             break
 
 
+@traced("patch_new_tender_status")
 async def patch_new_tender_status(dialog: dict, session: ClientSession) -> None:
     patch_data = {
         "id": dialog["stage2TenderID"],
         "status": STAGE2_STATUS,
         "dialogueID": dialog["id"]
     }
+    set_span_attribute("tender.id", patch_data["id"])
     url = f"{BASE_URL}/tenders/{patch_data['id']}"
+    if DRY_RUN:
+        from prozorro_bridge_competitivedialogue import dry_run
+        return dry_run.record_intent(dialog["id"], "patch_new_tender_status", "PATCH", url, {"data": patch_data})
+    request = encode_body(patch_data)
     while True:
         LOGGER.info(
             f"Patch tender stage2 id={patch_data['id']} with status {patch_data['status']}",
@@ -238,8 +293,9 @@ async def patch_new_tender_status(dialog: dict, session: ClientSession) -> None:
                 {"TENDER_ID": patch_data["id"]})
         )
         try:
-            response = await session.patch(url, json={"data": patch_data}, headers=HEADERS)
+            response = await session.patch(url, **request)
             data = await response.text()
+            record_exchange("patch_new_tender_status", response, data, request["data"])
             if response.status != 200:
                 LOGGER.info(
                     f"Unsuccessful patch tender stage2 id={patch_data['id']} with status {patch_data['status']}",
@@ -257,6 +313,7 @@ async def patch_new_tender_status(dialog: dict, session: ClientSession) -> None:
                 )
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
         else:
             data = json.loads(data)["data"]
@@ -270,9 +327,15 @@ async def patch_new_tender_status(dialog: dict, session: ClientSession) -> None:
             break
 
 
+@traced("patch_dialog_status")
 async def patch_dialog_status(dialogue_id: str, session: ClientSession) -> None:
+    set_span_attribute("tender.id", dialogue_id)
     patch_data = {"id": dialogue_id, "status": "complete"}
     url = f"{BASE_URL}/tenders/{dialogue_id}"
+    if DRY_RUN:
+        from prozorro_bridge_competitivedialogue import dry_run
+        return dry_run.record_intent(dialogue_id, "patch_dialog_status", "PATCH", url, {"data": patch_data})
+    request = encode_body(patch_data)
     while True:
         LOGGER.info(
             f"Patch competitive dialogue id={dialogue_id} with status {patch_data['status']}",
@@ -282,8 +345,9 @@ async def patch_dialog_status(dialogue_id: str, session: ClientSession) -> None:
             )
         )
         try:
-            response = await session.patch(url, json={"data": patch_data}, headers=HEADERS)
+            response = await session.patch(url, **request)
             data = await response.text()
+            record_exchange("patch_dialog_status", response, data, request["data"])
             if response.status in (403, 422):
                 LOGGER.error(
                     f"Stop trying patch dialogue id={patch_data['id']} with status {patch_data['status']}. "
@@ -312,6 +376,7 @@ async def patch_dialog_status(dialogue_id: str, session: ClientSession) -> None:
                 )
             )
             LOGGER.exception(e)
+            record_retry()
             await asyncio.sleep(ERROR_INTERVAL)
         else:
             data = json.loads(data)["data"]
@@ -325,23 +390,77 @@ async def patch_dialog_status(dialogue_id: str, session: ClientSession) -> None:
             break
 
 
+async def complete_stage2(
+    session: ClientSession, tender: dict, tender_dialog: dict, steps: tuple = shutdown.STAGE2_STEPS
+) -> None:
+    for step in steps:
+        if shutdown.should_stop(tender, step, tender_dialog):
+            return None
+        with step_timer(step, tender["id"]):
+            if step == "patch_dialog_add_stage2_id":
+                await patch_dialog_add_stage2_id(tender_dialog, session)
+            elif step == "patch_new_tender_status":
+                await patch_new_tender_status(tender_dialog, session)
+            elif step == "patch_dialog_status":
+                await patch_dialog_status(tender["id"], session)
+
+
+def add_dead_letter(tender: dict, reason: str, details: str = "") -> None:
+    dead_letter.add(tender, reason, details)
+    # the dialogue comes back when it's modified in the feed, a quick fix by the owner reuses the credentials
+    credentials_cache.renew(tender["id"])
+
+
 async def process_tender(session: ClientSession, tender: dict) -> None:
     if not check_tender(tender):
         return None
+    if tender["id"] in INFLIGHT:
+        # the same dialogue is already processed, e.g. resumed from the shutdown checkpoint
+        return None
+    if dead_letter.is_dead(tender):
+        return None
 
-    create_second_stage = await check_second_stage_tender(tender, session)
-
-    if create_second_stage:
-        tender_to_sync = await get_tender(tender["id"], session)
-        credentials = await get_tender_credentials(tender["id"], session)
-        try:
-            new_tender = prepare_new_tender_data(tender_to_sync, credentials)
-        except KeyError:
+    with track_dialogue(tender["id"], tender), start_span("process_tender", **{"tender.id": tender["id"]}):
+        resumed = shutdown.pop_checkpoint(tender["id"])
+        if resumed and resumed["step"] in shutdown.STAGE2_STEPS:
+            steps = shutdown.STAGE2_STEPS[shutdown.STAGE2_STEPS.index(resumed["step"]):]
+            INFLIGHT[tender["id"]]["dialog"] = resumed["dialog"]
+            return await complete_stage2(session, tender, resumed["dialog"], steps)
+        if shutdown.should_stop(tender, shutdown.STEP_PROCESS):
             return None
-        tender_dialog = await create_tender_stage2(new_tender, session)
-        if tender_dialog:
-            await patch_dialog_add_stage2_id(tender_dialog, session)
-            await patch_new_tender_status(tender_dialog, session)
-            await patch_dialog_status(tender["id"], session)
-    else:
-        await patch_dialog_status(tender["id"], session)
+
+        with step_timer("check_second_stage_tender", tender["id"]):
+            create_second_stage = await check_second_stage_tender(tender, session)
+
+        if create_second_stage:
+            with step_timer("get_tender", tender["id"]):
+                tender_to_sync = await get_tender(tender["id"], session)
+            try:
+                # keep only the projection while the rest of the requests are in flight
+                tender_to_sync = Tender.from_dict(tender_to_sync)
+            except KeyError as e:
+                dead_letter.add(tender, dead_letter.REASON_INVALID_TENDER, str(e))
+                return None
+            credentials = credentials_cache.get(tender["id"])
+            if credentials is None:
+                with step_timer("get_tender_credentials", tender["id"]):
+                    credentials = await get_tender_credentials(tender["id"], session)
+                credentials_cache.put(tender["id"], credentials)
+            try:
+                with step_timer("prepare_new_tender_data", tender["id"], threshold=SLOW_CALLBACK_THRESHOLD):
+                    new_tender = prepare_new_tender_data(tender_to_sync, credentials)
+            except KeyError as e:
+                add_dead_letter(tender, dead_letter.REASON_MISSING_RELATED_LOT, str(e))
+                return None
+            if shutdown.should_stop(tender, shutdown.STEP_PROCESS):
+                return None
+            with step_timer("create_tender_stage2", tender["id"]):
+                tender_dialog = await create_tender_stage2(new_tender, session)
+            if not tender_dialog:
+                add_dead_letter(tender, dead_letter.REASON_CREATE_REJECTED)
+            else:
+                credentials_cache.invalidate(tender["id"])
+                INFLIGHT[tender["id"]]["dialog"] = tender_dialog
+                await complete_stage2(session, tender, tender_dialog)
+        else:
+            await complete_stage2(session, tender, None, ("patch_dialog_status",))
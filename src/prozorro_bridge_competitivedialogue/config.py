@@ -0,0 +1,171 @@
+import asyncio
+import importlib
+import json
+import os
+import signal
+
+from prozorro_bridge_competitivedialogue import metrics, settings
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    CONFIG_FILE,
+    CONFIG_RELOAD_INTERVAL,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_CONFIG_RELOADED,
+    DATABRIDGE_CONFIG_INVALID,
+)
+
+
+def parse_statuses(value) -> tuple:
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(status, str) for status in value):
+        raise ValueError("statuses should be a comma separated string or a list of strings")
+    return tuple(status.strip() for status in value if status.strip())
+
+
+# setting -> (parser, modules that imported it)
+RELOADABLE = {
+    "ERROR_INTERVAL": (int, ("bridge",)),
+    "ALLOWED_STATUSES": (parse_statuses, ("bridge",)),
+    "REWRITE_STATUSES": (parse_statuses, ("bridge",)),
+    "SLOW_CALLBACK_THRESHOLD": (float, ("bridge",)),
+    "SLOW_STEP_THRESHOLD": (float, ("monitoring",)),
+    "LOOP_LAG_INTERVAL": (float, ("monitoring",)),
+    "LOOP_LAG_THRESHOLD": (float, ("monitoring",)),
+    "DEAD_LETTER_TTL": (int, ("dead_letter",)),
+    "DEAD_LETTER_REFRESH_INTERVAL": (float, ("dead_letter",)),
+    "CREDENTIALS_CACHE_TTL": (int, ("credentials_cache",)),
+    "CREDENTIALS_CACHE_SIZE": (int, ("credentials_cache",)),
+    "SCHEDULER_CONCURRENCY": (int, ()),
+    "SCHEDULER_STAGE2_BONUS": (float, ("scheduler",)),
+    "LIMITER_MIN": (int, ()),
+    "LIMITER_MAX": (int, ()),
+    "LIMITER_WINDOW": (int, ()),
+    "LIMITER_TOLERANCE": (float, ()),
+    "LIMITER_BACKOFF": (float, ()),
+    "REQUEST_GZIP_MIN_SIZE": (int, ("utils",)),
+}
+
+# values from the environment, a setting removed from the config file goes back to it
+DEFAULTS = {name: getattr(settings, name) for name in RELOADABLE}
+_mtime = None
+
+
+def read_file(path: str) -> dict:
+    """Reads a json object or KEY=VALUE lines in the env file format"""
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".json"):
+        values = json.loads(text)
+        if not isinstance(values, dict):
+            raise ValueError("json config should be an object")
+        return values
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            name, _, value = line.partition("=")
+            values[name.strip()] = value.strip().strip("\"'")
+    return values
+
+
+def parse(values: dict) -> tuple:
+    """Returns the new settings and the list of errors"""
+    errors = []
+    parsed = dict(DEFAULTS)
+    for name, value in values.items():
+        if name not in RELOADABLE:
+            errors.append(f"{name} can't be changed at runtime")
+            continue
+        try:
+            parsed[name] = RELOADABLE[name][0](value)
+        except (TypeError, ValueError):
+            errors.append(f"{name} has invalid value {value!r}")
+    if not errors:
+        previous = {name: getattr(settings, name) for name in parsed}
+        vars(settings).update(parsed)
+        try:
+            errors = settings.validate_settings()
+        finally:
+            vars(settings).update(previous)
+    return parsed, errors
+
+
+def apply(values: dict, scheduler=None, limiter=None) -> dict:
+    """Sets the new values to the settings and the modules that use them, returns the changed ones"""
+    changed = {name: value for name, value in values.items() if getattr(settings, name) != value}
+    for name, value in changed.items():
+        setattr(settings, name, value)
+        for module in RELOADABLE[name][1]:
+            setattr(importlib.import_module(f"prozorro_bridge_competitivedialogue.{module}"), name, value)
+        if isinstance(value, (int, float)):
+            metrics.set_gauge("config_value", value, setting=name)
+    if scheduler is not None and "SCHEDULER_CONCURRENCY" in changed:
+        scheduler.resize(settings.SCHEDULER_CONCURRENCY)
+    if limiter is not None:
+        limiter.min_limit = settings.LIMITER_MIN
+        limiter.max_limit = settings.LIMITER_MAX
+        limiter.window = settings.LIMITER_WINDOW
+        limiter.tolerance = settings.LIMITER_TOLERANCE
+        limiter.backoff = settings.LIMITER_BACKOFF
+        limiter.limit = min(max(limiter.limit, limiter.min_limit), limiter.max_limit)
+    return changed
+
+
+def reload(path: str = CONFIG_FILE, scheduler=None, limiter=None) -> bool:
+    """Applies the config file when it's valid, the current settings are kept otherwise"""
+    try:
+        values, errors = parse(read_file(path))
+    except (OSError, ValueError) as e:
+        errors = [f"can't read {path}: {e}"]
+    if errors:
+        metrics.inc("config_reloads_total", result="invalid")
+        for error in errors:
+            LOGGER.error(
+                f"Config is not reloaded: {error}",
+                extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONFIG_INVALID}),
+            )
+        return False
+    changed = apply(values, scheduler, limiter)
+    metrics.inc("config_reloads_total", result="applied" if changed else "unchanged")
+    if changed:
+        LOGGER.info(
+            f"Config reloaded: {changed}",
+            extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONFIG_RELOADED}, {"CHANGED": list(changed)}),
+        )
+    return True
+
+
+def check(path: str = CONFIG_FILE, scheduler=None, limiter=None) -> None:
+    """Reloads the config file if it has been modified since the last check"""
+    global _mtime
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _mtime:
+        _mtime = mtime
+        if mtime is None:
+            # the file is removed, back to the environment values
+            apply(DEFAULTS, scheduler, limiter)
+        else:
+            reload(path, scheduler, limiter)
+
+
+def run_safely(func, *args) -> None:
+    """An unexpected error is counted as an invalid config, it must not stop the watcher"""
+    try:
+        func(*args)
+    except Exception as e:
+        metrics.inc("config_reloads_total", result="invalid")
+        LOGGER.exception(e, extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONFIG_INVALID}))
+
+
+async def watch(scheduler=None, limiter=None, path: str = CONFIG_FILE,
+                interval: float = CONFIG_RELOAD_INTERVAL) -> None:
+    asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, run_safely, reload, path, scheduler, limiter)
+    while True:
+        run_safely(check, path, scheduler, limiter)
+        await asyncio.sleep(interval)
@@ -0,0 +1,80 @@
+from typing import Optional
+import json
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    CREDENTIALS_CACHE_TTL,
+    CREDENTIALS_CACHE_SIZE,
+    CREDENTIALS_CACHE_ENCRYPT,
+)
+
+
+# tender id -> (expiration timestamp, credentials) in the order of their expiration, never persisted
+_cache = {}
+_fernet = None
+
+
+def _get_fernet():
+    global _fernet
+    if _fernet is None:
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            LOGGER.warning("CREDENTIALS_CACHE_ENCRYPT is set but cryptography isn't installed, caching is disabled")
+            _fernet = False
+        else:
+            # the key lives only in this process memory
+            _fernet = Fernet(Fernet.generate_key())
+    return _fernet
+
+
+def _enabled() -> bool:
+    return CREDENTIALS_CACHE_TTL > 0 and (not CREDENTIALS_CACHE_ENCRYPT or bool(_get_fernet()))
+
+
+def get(tender_id: str) -> Optional[dict]:
+    if not _enabled():
+        return None
+    expires, value = _cache.get(tender_id, (0, None))
+    if expires < time.monotonic():
+        _cache.pop(tender_id, None)
+        metrics.inc("credentials_cache_misses_total")
+        return None
+    metrics.inc("credentials_cache_hits_total")
+    if CREDENTIALS_CACHE_ENCRYPT:
+        return json.loads(_get_fernet().decrypt(value))
+    return dict(value)
+
+
+def put(tender_id: str, credentials: dict) -> None:
+    if not _enabled():
+        return
+    now = time.monotonic()
+    for key in [key for key, (expires, _) in _cache.items() if expires < now]:
+        del _cache[key]
+    _cache.pop(tender_id, None)
+    while _cache and len(_cache) >= CREDENTIALS_CACHE_SIZE:
+        del _cache[next(iter(_cache))]
+        metrics.inc("credentials_cache_evictions_total")
+    if CREDENTIALS_CACHE_ENCRYPT:
+        value = _get_fernet().encrypt(json.dumps(credentials).encode())
+    else:
+        value = dict(credentials)
+    _cache[tender_id] = (now + CREDENTIALS_CACHE_TTL, value)
+
+
+def renew(tender_id: str) -> None:
+    """Keeps the cached credentials for CREDENTIALS_CACHE_TTL seconds from now"""
+    if tender_id in _cache:
+        _, value = _cache.pop(tender_id)
+        _cache[tender_id] = (time.monotonic() + CREDENTIALS_CACHE_TTL, value)
+
+
+def invalidate(tender_id: str) -> None:
+    _cache.pop(tender_id, None)
+
+
+def clear() -> None:
+    _cache.clear()
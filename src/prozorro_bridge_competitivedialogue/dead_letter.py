@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+import asyncio
+import json
+import os
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    DEAD_LETTER_DB,
+    DEAD_LETTER_TTL,
+    DEAD_LETTER_REFRESH_INTERVAL,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_DEAD_LETTER,
+    DATABRIDGE_SKIP_DEAD_LETTER,
+)
+
+
+REASON_CREATE_REJECTED = "create_rejected"
+REASON_MISSING_RELATED_LOT = "missing_related_lot"
+REASON_INVALID_TENDER = "invalid_tender"
+
+# negative cache: tender id -> (expiration timestamp, dateModified), re-read from the store
+# every DEAD_LETTER_REFRESH_INTERVAL seconds to see the changes made by the CLI
+_cache = None
+_cache_loaded = 0
+# the store is opened once, the table is created on the first use
+_connection = None
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        # the store is needed only when a dialogue waits for stage 2, it isn't imported at start up
+        import sqlite3
+        _connection = sqlite3.connect(DEAD_LETTER_DB)
+        _connection.row_factory = sqlite3.Row
+        with _connection:
+            _connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "tender_id TEXT PRIMARY KEY, reason TEXT NOT NULL, details TEXT, date_modified TEXT, "
+                "created REAL NOT NULL, expires REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 1)"
+            )
+    return _connection
+
+
+@contextmanager
+def connect():
+    connection = _get_connection()
+    with connection:
+        yield connection
+
+
+def close() -> None:
+    global _connection, _cache
+    if _connection is not None:
+        _connection.close()
+    _connection, _cache = None, None
+
+
+def _get_cache() -> dict:
+    global _cache, _cache_loaded
+    if _cache is None or time.monotonic() - _cache_loaded > DEAD_LETTER_REFRESH_INTERVAL:
+        with connect() as connection:
+            rows = connection.execute("SELECT tender_id, expires, date_modified FROM dead_letters")
+            _cache = {row["tender_id"]: (row["expires"], row["date_modified"]) for row in rows}
+        _cache_loaded = time.monotonic()
+    return _cache
+
+
+@contextmanager
+def isolated():
+    """Switches to a temporary store without the negative cache, e.g. for a replay of recorded traffic"""
+    global DEAD_LETTER_DB, DEAD_LETTER_TTL, _connection, _cache
+    import tempfile
+
+    previous = DEAD_LETTER_DB, DEAD_LETTER_TTL, _connection, _cache
+    with tempfile.TemporaryDirectory() as directory:
+        DEAD_LETTER_DB, DEAD_LETTER_TTL = os.path.join(directory, "dead_letters.sqlite"), 0
+        _connection, _cache = None, None
+        try:
+            yield
+        finally:
+            close()
+            DEAD_LETTER_DB, DEAD_LETTER_TTL, _connection, _cache = previous
+
+
+def add(tender: dict, reason: str, details: str = "") -> None:
+    now = time.time()
+    expires = now + DEAD_LETTER_TTL
+    with connect() as connection:
+        connection.execute(
+            "INSERT INTO dead_letters (tender_id, reason, details, date_modified, created, expires) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(tender_id) DO UPDATE SET reason=excluded.reason, details=excluded.details, "
+            "date_modified=excluded.date_modified, expires=excluded.expires, attempts=attempts + 1",
+            (tender["id"], reason, details, tender.get("dateModified"), now, expires),
+        )
+    _get_cache()[tender["id"]] = (expires, tender.get("dateModified"))
+    metrics.inc("dead_letters_total", reason=reason)
+    LOGGER.warning(
+        f"Dialogue {tender['id']} moved to dead letters, reason: {reason}",
+        extra=journal_context(
+            {"MESSAGE_ID": DATABRIDGE_DEAD_LETTER},
+            {"TENDER_ID": tender["id"], "REASON": reason}
+        ),
+    )
+
+
+def is_modified_since(tender: dict, date_modified: Optional[str]) -> bool:
+    try:
+        return datetime.fromisoformat(tender["dateModified"]) > datetime.fromisoformat(date_modified)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def is_dead(tender: dict) -> bool:
+    if not DEAD_LETTER_TTL:
+        return False
+    expires, date_modified = _get_cache().get(tender["id"], (None, None))
+    if expires is None or expires < time.time():
+        return False
+    if is_modified_since(tender, date_modified):
+        # the dialogue has been changed since it failed, it's worth another try
+        return False
+    metrics.inc("dead_letter_skips_total")
+    LOGGER.debug(
+        f"Skipping dialogue {tender['id']} from dead letters",
+        extra=journal_context(
+            {"MESSAGE_ID": DATABRIDGE_SKIP_DEAD_LETTER},
+            {"TENDER_ID": tender["id"]}
+        ),
+    )
+    return True
+
+
+def get(tender_id: str) -> Optional[dict]:
+    with connect() as connection:
+        row = connection.execute("SELECT * FROM dead_letters WHERE tender_id = ?", (tender_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def list_entries(reason: str = None) -> list:
+    query, params = "SELECT * FROM dead_letters", ()
+    if reason:
+        query, params = query + " WHERE reason = ?", (reason,)
+    with connect() as connection:
+        return [dict(row) for row in connection.execute(query + " ORDER BY created", params)]
+
+
+def remove(tender_id: str) -> None:
+    with connect() as connection:
+        connection.execute("DELETE FROM dead_letters WHERE tender_id = ?", (tender_id,))
+    _get_cache().pop(tender_id, None)
+
+
+async def replay(tender_ids: list) -> None:
+    from aiohttp import ClientSession
+    from prozorro_bridge_competitivedialogue.bridge import get_tender, process_tender
+
+    async with ClientSession() as session:
+        for tender_id in tender_ids:
+            remove(tender_id)
+            tender = await get_tender(tender_id, session)
+            if tender:
+                await process_tender(session, tender)
+
+
+def cli(args: list = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect and replay dead-lettered competitive dialogues")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list")
+    list_parser.add_argument("--reason")
+    commands.add_parser("show").add_argument("tender_id")
+    commands.add_parser("remove").add_argument("tender_id")
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("tender_ids", nargs="*")
+    replay_parser.add_argument("--all", action="store_true")
+    args = parser.parse_args(args)
+
+    if args.command == "list":
+        for entry in list_entries(args.reason):
+            print(f"{entry['tender_id']}\t{entry['reason']}\tattempts={entry['attempts']}\t"
+                  f"expires={time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(entry['expires']))}")
+    elif args.command == "show":
+        print(json.dumps(get(args.tender_id), indent=2))
+    elif args.command == "remove":
+        remove(args.tender_id)
+    elif args.command == "replay":
+        tender_ids = [entry["tender_id"] for entry in list_entries()] if args.all else args.tender_ids
+        asyncio.run(replay(tender_ids))
+
+
+if __name__ == "__main__":
+    cli()
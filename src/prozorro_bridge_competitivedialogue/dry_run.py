@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+import asyncio
+import json
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    DRY_RUN_DB,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import DATABRIDGE_DRY_RUN_INTENT
+
+
+# payload fields that are expected to differ from the created stage 2
+IGNORED_DIFF_FIELDS = ("owner", "dialogue_token", "status")
+
+
+@contextmanager
+def connect():
+    import sqlite3
+
+    connection = sqlite3.connect(DRY_RUN_DB)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS intents ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, dialogue_id TEXT NOT NULL, operation TEXT NOT NULL, "
+                "method TEXT NOT NULL, url TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            yield connection
+    finally:
+        connection.close()
+
+
+def record_intent(dialogue_id: str, operation: str, method: str, url: str, payload: dict) -> None:
+    with connect() as connection:
+        connection.execute(
+            "INSERT INTO intents (dialogue_id, operation, method, url, payload, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (dialogue_id, operation, method, url, json.dumps(payload), time.time()),
+        )
+    metrics.inc("dry_run_intents_total", operation=operation)
+    LOGGER.info(
+        f"Dry run: {method} {url} for dialogue {dialogue_id} recorded",
+        extra=journal_context(
+            {"MESSAGE_ID": DATABRIDGE_DRY_RUN_INTENT},
+            {"TENDER_ID": dialogue_id, "OPERATION": operation}
+        ),
+    )
+
+
+def record_create(new_tender: dict, url: str) -> dict:
+    payload = {"data": dict(new_tender, dialogue_token="***")}
+    record_intent(new_tender["dialogueID"], "create_tender_stage2", "POST", url, payload)
+    return {"id": new_tender["dialogueID"], "stage2TenderID": f"dry-run-{new_tender['dialogueID']}"}
+
+
+def list_intents(operation: str = None) -> list:
+    query, params = "SELECT * FROM intents", ()
+    if operation:
+        query, params = query + " WHERE operation = ?", (operation,)
+    with connect() as connection:
+        rows = connection.execute(query + " ORDER BY id", params)
+        return [dict(row, payload=json.loads(row["payload"])) for row in rows]
+
+
+def get_throughput(intents: list) -> float:
+    """Dialogues per second between the first and the last recorded intent"""
+    if len(intents) < 2:
+        return 0.0
+    duration = intents[-1]["created"] - intents[0]["created"]
+    dialogues = len({intent["dialogue_id"] for intent in intents})
+    return dialogues / duration if duration else 0.0
+
+
+def diff_payload(payload: dict, tender_stage2: dict) -> dict:
+    """Fields of the dry run payload that differ from the stage 2 tender created in production"""
+    diff = {}
+    for field, value in payload.items():
+        if field in IGNORED_DIFF_FIELDS:
+            continue
+        if tender_stage2.get(field) != value:
+            diff[field] = {"dry_run": value, "production": tender_stage2.get(field)}
+    return diff
+
+
+async def report(session) -> dict:
+    from prozorro_bridge_competitivedialogue.bridge import get_tender
+
+    intents = list_intents()
+    result = {"intents": len(intents), "throughput": get_throughput(intents), "diffs": {}}
+    for intent in intents:
+        if intent["operation"] != "create_tender_stage2":
+            continue
+        dialogue = await get_tender(intent["dialogue_id"], session)
+        if not dialogue.get("stage2TenderID"):
+            result["diffs"][intent["dialogue_id"]] = None
+            continue
+        tender_stage2 = await get_tender(dialogue["stage2TenderID"], session)
+        result["diffs"][intent["dialogue_id"]] = diff_payload(intent["payload"]["data"], tender_stage2)
+    return result
+
+
+def cli(args: list = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect requests recorded in the dry run mode")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list").add_argument("--operation")
+    commands.add_parser("report")
+    args = parser.parse_args(args)
+
+    if args.command == "list":
+        for intent in list_intents(args.operation):
+            print(f"{intent['dialogue_id']}\t{intent['method']} {intent['url']}\t{json.dumps(intent['payload'])}")
+    elif args.command == "report":
+        from aiohttp import ClientSession
+
+        async def run():
+            async with ClientSession() as session:
+                return await report(session)
+
+        print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,48 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+MODULE = "prozorro_bridge_competitivedialogue.main"
+
+
+def parse_importtime(output: str) -> dict:
+    """Parses `python -X importtime` output into module -> (self us, cumulative us)"""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(module: str = MODULE) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def cli(args: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure the import time of the bridge")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of the slowest modules to print")
+    parser.add_argument("--max-ms", type=float, help="exit with an error if the median import time is higher")
+    args = parser.parse_args(args)
+
+    runs = [measure() for _ in range(args.runs)]
+    totals = [run[MODULE][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+    print(f"import {MODULE}: median {median:.1f} ms, min {min(totals):.1f} ms, max {max(totals):.1f} ms")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{self_us / 1000:>8.1f} ms self {cumulative_us / 1000:>8.1f} ms cumulative  {name}")
+    if args.max_ms is not None and median > args.max_ms:
+        sys.exit(f"Import time {median:.1f} ms is higher than {args.max_ms} ms")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,6 +1,7 @@
 DATABRIDGE_GET_CREDENTIALS = "cd_bridge_get_tender_credentials"
 DATABRIDGE_GOT_CREDENTIALS = "cd_bridge_got_tender_credentials"
 DATABRIDGE_FOUND_NOLOT = "cd_bridge_found_nolot"
+DATABRIDGE_LOT_NOT_FOUND = "cd_bridge_lot_not_found"
 DATABRIDGE_COPY_TENDER_ITEMS = "cd_bridge_prepare_items"
 DATABRIDGE_CREATE_NEW_TENDER = "cd_bridge_create_new_tender"
 DATABRIDGE_TENDER_CREATED = "cd_bridge_tender_created"
@@ -18,3 +19,21 @@ DATABRIDGE_ONLY_PATCH = "cd_bridge_need_patch"
 DATABRIDGE_TENDER_STAGE2_NOT_EXIST = "cd_bridge_tender_stage2_not_exist"
 DATABRIDGE_CREATE_NEW_STAGE2 = "cd_bridge_create_new_tender_stage2"
 DATABRIDGE_EXCEPTION = "cd_bridge_exception"
+DATABRIDGE_SLOW_STEP = "cd_bridge_slow_step"
+DATABRIDGE_LOOP_LAG = "cd_bridge_loop_lag"
+DATABRIDGE_TRACE_SPAN = "cd_bridge_trace_span"
+DATABRIDGE_DEAD_LETTER = "cd_bridge_dead_letter"
+DATABRIDGE_SKIP_DEAD_LETTER = "cd_bridge_skip_dead_letter"
+DATABRIDGE_RECONCILE_PAGE = "cd_bridge_reconcile_page"
+DATABRIDGE_RECONCILE_PLAN = "cd_bridge_reconcile_plan"
+DATABRIDGE_DRY_RUN_INTENT = "cd_bridge_dry_run_intent"
+DATABRIDGE_LIMIT_CHANGED = "cd_bridge_limit_changed"
+DATABRIDGE_STATUS_SERVER_STARTED = "cd_bridge_status_server_started"
+DATABRIDGE_DRAIN_STARTED = "cd_bridge_drain_started"
+DATABRIDGE_DRAIN_FINISHED = "cd_bridge_drain_finished"
+DATABRIDGE_DRAIN_CHECKPOINT = "cd_bridge_drain_checkpoint"
+DATABRIDGE_RESUME_CHECKPOINT = "cd_bridge_resume_checkpoint"
+DATABRIDGE_CONFIG_RELOADED = "cd_bridge_config_reloaded"
+DATABRIDGE_CONFIG_INVALID = "cd_bridge_config_invalid"
+DATABRIDGE_PROFILE_STARTED = "cd_bridge_profile_started"
+DATABRIDGE_PROFILE_SAVED = "cd_bridge_profile_saved"
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    LIMITER_MIN,
+    LIMITER_MAX,
+    LIMITER_INITIAL,
+    LIMITER_WINDOW,
+    LIMITER_TOLERANCE,
+    LIMITER_BACKOFF,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import DATABRIDGE_LIMIT_CHANGED
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def is_overload(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit of concurrent API requests.
+    After every window of requests the limit grows by one while p95 latency stays
+    within LIMITER_TOLERANCE of its long term average and the limit has been reached in the window,
+    and is multiplied by LIMITER_BACKOFF
+    when latency climbs or the API answers with 429/5xx.
+    The long term average follows every window without overload responses, slower ones included,
+    so a lasting latency shift stops the backoff after a few windows
+    """
+
+    def __init__(
+        self,
+        min_limit: int = LIMITER_MIN,
+        max_limit: int = LIMITER_MAX,
+        initial: int = LIMITER_INITIAL,
+        window: int = LIMITER_WINDOW,
+        tolerance: float = LIMITER_TOLERANCE,
+        backoff: float = LIMITER_BACKOFF,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.inflight = 0
+        # the highest number of requests in flight during the current window
+        self.max_inflight = 0
+        self.latencies = []
+        self.errors = 0
+        self.baseline = None
+        self.condition = None
+
+    async def acquire(self) -> None:
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        metrics.set_gauge("limiter_inflight", self.inflight)
+
+    async def release(self, latency: float, overload: bool) -> None:
+        async with self.condition:
+            self.inflight -= 1
+            self.latencies.append(latency)
+            self.errors += overload
+            if len(self.latencies) >= self.window:
+                self.update()
+            self.condition.notify(max(int(self.limit) - self.inflight, 0))
+        metrics.set_gauge("limiter_inflight", self.inflight)
+
+    def update(self) -> None:
+        p95 = percentile(self.latencies, 0.95)
+        previous = self.limit
+        if self.errors or (self.baseline is not None and p95 > self.baseline * self.tolerance):
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif self.max_inflight >= int(self.limit):
+            # the limit isn't raised while it doesn't restrict anything
+            self.limit = min(self.max_limit, self.limit + 1)
+        if not self.errors:
+            # 429/5xx are answered fast, they would pull the average down
+            self.baseline = p95 if self.baseline is None else self.baseline * 0.9 + p95 * 0.1
+        metrics.set_gauge("limiter_limit", int(self.limit))
+        metrics.set_gauge("limiter_latency_p95_seconds", p95)
+        if int(self.limit) != int(previous):
+            LOGGER.info(
+                f"Concurrency limit changed {int(previous)} -> {int(self.limit)}, "
+                f"p95 {p95:.3f}s, overload responses {self.errors}",
+                extra=journal_context(
+                    {"MESSAGE_ID": DATABRIDGE_LIMIT_CHANGED},
+                    {"LIMIT": int(self.limit), "P95": round(p95, 6), "ERRORS": self.errors}
+                ),
+            )
+        self.latencies, self.errors, self.max_inflight = [], 0, self.inflight
+
+
+class LimitedSession:
+    """Proxies the bridge requests to the session through the adaptive limiter"""
+
+    def __init__(self, session, limiter: AdaptiveLimiter):
+        self.session = session
+        self.limiter = limiter
+
+    async def request(self, method: str, url: str, **kwargs):
+        await self.limiter.acquire()
+        start = time.monotonic()
+        overload = True
+        try:
+            response = await getattr(self.session, method)(url, **kwargs)
+            overload = is_overload(response.status)
+            # the body is read under the limit, its transfer is a part of the latency.
+            # aiohttp keeps it, response.text() doesn't read it again
+            await response.read()
+            return response
+        finally:
+            await self.limiter.release(time.monotonic() - start, overload)
+
+    async def get(self, url: str, **kwargs):
+        return await self.request("get", url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request("post", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs):
+        return await self.request("patch", url, **kwargs)
@@ -1,8 +1,21 @@
 from aiohttp import ClientSession
 import asyncio
-from prozorro_crawler.main import main
+import sys
 
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    HTTP_RECORD_FILE,
+    STATUS_PORT,
+    CONFIG_FILE,
+    PROFILE_ENABLED,
+    MONGODB_URL,
+    validate_settings,
+)
 from prozorro_bridge_competitivedialogue.bridge import process_tender
+from prozorro_bridge_competitivedialogue.monitoring import sample_loop_lag, record_feed_page, process_uptime
+from prozorro_bridge_competitivedialogue.scheduler import PriorityScheduler
+from prozorro_bridge_competitivedialogue.limiter import AdaptiveLimiter, LimitedSession
+from prozorro_bridge_competitivedialogue import metrics, shutdown
 
 
 API_OPT_FIELDS = (
@@ -11,14 +24,68 @@ API_OPT_FIELDS = (
     "stage2TenderID",
 )
 
+SCHEDULER = PriorityScheduler(process_tender)
+LIMITER = AdaptiveLimiter()
+RECORDER = None
+
+
+def get_session(session: ClientSession):
+    global RECORDER
+    if HTTP_RECORD_FILE:
+        if RECORDER is None:
+            from prozorro_bridge_competitivedialogue.recorder import RecordingSession
+            RECORDER = RecordingSession(session)
+        session = RECORDER
+    return LimitedSession(session, LIMITER)
+
+
+async def init_task(session: ClientSession) -> None:
+    asyncio.ensure_future(sample_loop_lag())
+    if STATUS_PORT:
+        from prozorro_bridge_competitivedialogue.status import start_status_server
+        await start_status_server(session)
+    if CONFIG_FILE:
+        from prozorro_bridge_competitivedialogue.config import watch
+        asyncio.ensure_future(watch(SCHEDULER, LIMITER))
+    if PROFILE_ENABLED:
+        from prozorro_bridge_competitivedialogue.profiler import install
+        install()
+    shutdown.install(SCHEDULER)
+
+    def resume(tender: dict) -> asyncio.Future:
+        # dialogues interrupted by the previous shutdown go before any feed item
+        return SCHEDULER.submit(get_session(session), tender, bonus=float("inf"))
+
+    await shutdown.resume(resume)
+    if MONGODB_URL:
+        asyncio.ensure_future(shutdown.watch_checkpoint(resume))
+    metrics.set_gauge("startup_seconds", process_uptime())
+
 
 async def data_handler(session: ClientSession, items: list) -> None:
+    if shutdown.DRAINING:
+        return await shutdown.block_while_draining()
+    record_feed_page(items)
+    session = get_session(session)
+    if RECORDER is not None:
+        RECORDER.record_items(items)
     process_items_tasks = []
     for item in items:
-        coroutine = process_tender(session, item)
-        process_items_tasks.append(coroutine)
+        future = SCHEDULER.submit(session, item)
+        process_items_tasks.append(future)
     await asyncio.gather(*process_items_tasks)
 
 
+def run() -> None:
+    errors = validate_settings()
+    if errors:
+        for error in errors:
+            LOGGER.critical(f"Invalid settings: {error}")
+        sys.exit(1)
+    # the crawler is imported only when the bridge is actually started
+    from prozorro_crawler.main import main
+    main(data_handler, init_task=init_task, opt_fields=API_OPT_FIELDS)
+
+
 if __name__ == "__main__":
-    main(data_handler, opt_fields=API_OPT_FIELDS)
+    run()
@@ -0,0 +1,80 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+COUNTERS: Dict[Tuple, float] = defaultdict(float)
+GAUGES: Dict[Tuple, float] = {}
+HISTOGRAMS: Dict[Tuple, dict] = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    COUNTERS[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    GAUGES[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    histogram = HISTOGRAMS.get(key)
+    if histogram is None:
+        histogram = HISTOGRAMS[key] = {
+            "buckets": [0] * len(DEFAULT_BUCKETS),
+            "count": 0,
+            "sum": 0.0,
+            "max": 0.0,
+        }
+    for i, bound in enumerate(DEFAULT_BUCKETS):
+        if value <= bound:
+            histogram["buckets"][i] += 1
+    histogram["count"] += 1
+    histogram["sum"] += value
+    histogram["max"] = max(histogram["max"], value)
+
+
+def get_counter(name: str, **labels) -> float:
+    return COUNTERS.get(_key(name, labels), 0)
+
+
+def get_gauge(name: str, **labels) -> float:
+    return GAUGES.get(_key(name, labels), 0)
+
+
+def get_histogram(name: str, **labels) -> dict:
+    return HISTOGRAMS.get(_key(name, labels), {})
+
+
+def reset() -> None:
+    COUNTERS.clear()
+    GAUGES.clear()
+    HISTOGRAMS.clear()
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render() -> str:
+    """Render all the collected metrics in the prometheus text format"""
+    lines = []
+    for (name, labels), value in sorted(COUNTERS.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(GAUGES.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(HISTOGRAMS.items()):
+        for bound, count in zip(DEFAULT_BUCKETS, histogram["buckets"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,66 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from prozorro_bridge_competitivedialogue.settings import COPY_NAME_FIELDS
+
+
+class Tenderer(NamedTuple):
+    name: str
+    identifier: dict
+
+
+class Bid(NamedTuple):
+    id: str
+    tenderers: Tuple[Tenderer, ...]
+
+
+class Qualification(NamedTuple):
+    status: str
+    lot_id: Optional[str]
+    bid_id: str
+
+
+class Tender(NamedTuple):
+    """Projection of a competitive dialogue with only the fields needed to create its stage 2"""
+    id: str
+    tender_id: str
+    procurement_method_type: str
+    copy_fields: dict
+    lots: Dict[str, dict]
+    items: Tuple[dict, ...]
+    bids: Dict[str, Bid]
+    qualifications: Tuple[Qualification, ...]
+    features: Optional[Tuple[dict, ...]]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Tender":
+        qualifications = tuple(
+            Qualification(status=q["status"], lot_id=q.get("lotID"), bid_id=q["bidID"])
+            for q in data["qualifications"]
+        )
+        # only bids of the active qualifications are shortlisted
+        active_bids = {q.bid_id for q in qualifications if q.status == "active"}
+        bids = {
+            bid["id"]: Bid(
+                id=bid["id"],
+                tenderers=tuple(
+                    Tenderer(name=tenderer["name"], identifier=tenderer["identifier"])
+                    for tenderer in bid.get("tenderers", ())
+                ),
+            )
+            for bid in data.get("bids", ())
+            if bid["id"] in active_bids
+        }
+        missing_bids = active_bids - set(bids)
+        if missing_bids:
+            raise KeyError(f"Active qualifications refer to missing bids: {', '.join(sorted(missing_bids))}")
+        return cls(
+            id=data["id"],
+            tender_id=data["tenderID"],
+            procurement_method_type=data["procurementMethodType"],
+            copy_fields={name: data[name] for name in COPY_NAME_FIELDS if name in data},
+            lots={lot["id"]: lot for lot in data.get("lots", ())},
+            items=tuple(data.get("items", ())),
+            bids=bids,
+            qualifications=qualifications,
+            features=tuple(data["features"]) if "features" in data else None,
+        )
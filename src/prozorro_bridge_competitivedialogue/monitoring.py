@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+import asyncio
+import os
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    LOOP_LAG_INTERVAL,
+    LOOP_LAG_THRESHOLD,
+    SLOW_STEP_THRESHOLD,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_SLOW_STEP,
+    DATABRIDGE_LOOP_LAG,
+)
+
+
+# dialogues that are currently processed: tender id -> current step and timestamps
+INFLIGHT = {}
+# last feed page handled by the bridge
+FEED_POSITION = {}
+STARTED = time.monotonic()
+LAST_PROGRESS = STARTED
+FIRST_DIALOGUE_PROCESSED = False
+
+
+def process_uptime() -> float:
+    """Seconds since the process start, including interpreter start up and imports"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - STARTED
+
+
+def record_progress(now: float = None) -> None:
+    global LAST_PROGRESS
+    LAST_PROGRESS = time.monotonic() if now is None else now
+
+
+def record_feed_page(items: list) -> None:
+    record_progress()
+    FEED_POSITION["received"] = time.time()
+    FEED_POSITION["items"] = len(items)
+    if items:
+        FEED_POSITION["last_id"] = items[-1].get("id")
+        FEED_POSITION["last_date_modified"] = items[-1].get("dateModified")
+
+
+@contextmanager
+def track_dialogue(tender_id: str, tender: dict = None):
+    now = time.monotonic()
+    INFLIGHT[tender_id] = {
+        "step": None, "started": now, "step_started": now, "tender": tender, "dialog": None,
+    }
+    metrics.set_gauge("inflight_dialogues", len(INFLIGHT))
+    try:
+        yield
+    finally:
+        INFLIGHT.pop(tender_id, None)
+        metrics.set_gauge("inflight_dialogues", len(INFLIGHT))
+        record_first_dialogue()
+
+
+def record_first_dialogue() -> None:
+    global FIRST_DIALOGUE_PROCESSED
+    if not FIRST_DIALOGUE_PROCESSED:
+        FIRST_DIALOGUE_PROCESSED = True
+        metrics.set_gauge("time_to_first_dialogue_seconds", process_uptime())
+
+
+@contextmanager
+def step_timer(step: str, tender_id: str, threshold: float = None):
+    if threshold is None:
+        threshold = SLOW_STEP_THRESHOLD
+    state = INFLIGHT.get(tender_id)
+    previous_step = None
+    start = time.monotonic()
+    if state is not None:
+        previous_step = state["step"]
+        state["step"], state["step_started"] = step, start
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        record_progress(end)
+        duration = end - start
+        if state is not None and previous_step is not None:
+            state["step"] = previous_step
+        metrics.observe("process_tender_step_seconds", duration, step=step)
+        if duration > threshold:
+            metrics.inc("slow_steps_total", step=step)
+            LOGGER.warning(
+                f"Slow step {step} for tender {tender_id}: {duration:.3f}s (threshold {threshold}s)",
+                extra=journal_context(
+                    {"MESSAGE_ID": DATABRIDGE_SLOW_STEP},
+                    {"TENDER_ID": tender_id, "STEP": step, "DURATION": round(duration, 6)}
+                ),
+            )
+
+
+async def measure_loop_lag(interval: float = None) -> float:
+    if interval is None:
+        interval = LOOP_LAG_INTERVAL
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await asyncio.sleep(interval)
+    lag = max(loop.time() - start - interval, 0)
+    metrics.set_gauge("event_loop_lag_seconds", lag)
+    metrics.observe("event_loop_lag_seconds_histogram", lag)
+    if lag > LOOP_LAG_THRESHOLD:
+        metrics.inc("event_loop_stalls_total")
+        now = time.monotonic()
+        inflight = {
+            tender_id: f"{state['step']} ({now - state['step_started']:.3f}s)"
+            for tender_id, state in INFLIGHT.items()
+        }
+        LOGGER.warning(
+            f"Event loop lag {lag:.3f}s, dialogues in flight: {inflight}",
+            extra=journal_context(
+                {"MESSAGE_ID": DATABRIDGE_LOOP_LAG},
+                {"LAG": round(lag, 6), "INFLIGHT": list(inflight)}
+            ),
+        )
+    return lag
+
+
+async def sample_loop_lag(interval: float = None) -> None:
+    while True:
+        await measure_loop_lag(interval)
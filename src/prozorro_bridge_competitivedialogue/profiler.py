@@ -0,0 +1,173 @@
+from collections import Counter
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    PROFILE_DIR,
+    PROFILE_SECONDS,
+    PROFILE_SAMPLE_INTERVAL,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_PROFILE_STARTED,
+    DATABRIDGE_PROFILE_SAVED,
+)
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP = 30
+
+# the running capture, only one at a time
+PROFILING = None
+
+
+def frame_name(code) -> str:
+    path = code.co_filename
+    if path.startswith(PACKAGE_DIR):
+        path = os.path.relpath(path, os.path.dirname(PACKAGE_DIR))
+    else:
+        path = os.path.join(*path.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def is_bridge_frame(name: str) -> bool:
+    return f"({os.path.basename(PACKAGE_DIR)}{os.sep}" in name
+
+
+class StackSampler:
+    """
+    Samples the stack of the event loop thread from a background thread.
+    Awaiting coroutines are not on the stack, so the time spent waiting for the API or in retry sleeps
+    is seen as the event loop select call
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+def function_stats(stacks: Counter) -> dict:
+    """Returns function -> [self samples, total samples]"""
+    stats = {}
+    for stack, samples in stacks.items():
+        for name in set(stack):
+            stats.setdefault(name, [0, 0])[1] += samples
+        stats[stack[-1]][0] += samples
+    return stats
+
+
+def write_folded(path: str, stacks: Counter) -> None:
+    """Collapsed stacks format, readable by flamegraph.pl and speedscope"""
+    with open(path, "w") as f:
+        for stack, samples in stacks.most_common():
+            f.write(f"{';'.join(stack)} {samples}\n")
+
+
+def format_functions(stats: dict, total: int, names: list) -> list:
+    lines = [f"{'self':>7} {'total':>7}  function"]
+    for name in names[:TOP]:
+        self_samples, total_samples = stats[name]
+        lines.append(f"{self_samples / total:>7.1%} {total_samples / total:>7.1%}  {name}")
+    return lines
+
+
+def write_summary(path: str, stacks: Counter, snapshot: tracemalloc.Snapshot, seconds: float) -> None:
+    total = sum(stacks.values()) or 1
+    stats = function_stats(stacks)
+    by_self = sorted(stats, key=lambda name: stats[name][0], reverse=True)
+    by_total = sorted(stats, key=lambda name: stats[name][1], reverse=True)
+    lines = [f"CPU: {sum(stacks.values())} samples in {seconds:.1f}s", "", "Top functions by self time"]
+    lines += format_functions(stats, total, by_self)
+    lines += ["", "Bridge functions by total time"]
+    lines += format_functions(stats, total, [name for name in by_total if is_bridge_frame(name)])
+
+    bridge_filter = [tracemalloc.Filter(True, os.path.join(PACKAGE_DIR, "*"))]
+    lines += ["", "Memory: top allocations by file"]
+    lines += [str(stat) for stat in snapshot.statistics("filename")[:TOP]]
+    lines += ["", "Memory: bridge allocations by line"]
+    lines += [str(stat) for stat in snapshot.filter_traces(bridge_filter).statistics("lineno")[:TOP]]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def save(prefix: str, stacks: Counter, seconds: float) -> dict:
+    snapshot = tracemalloc.take_snapshot()
+    paths = {
+        "cpu": f"{prefix}.folded",
+        "memory": f"{prefix}.tracemalloc",
+        "summary": f"{prefix}.txt",
+    }
+    write_folded(paths["cpu"], stacks)
+    snapshot.dump(paths["memory"])
+    write_summary(paths["summary"], stacks, snapshot, seconds)
+    return paths
+
+
+async def capture(seconds: float = PROFILE_SECONDS, directory: str = PROFILE_DIR) -> dict:
+    """Samples the process for the given time and writes the profiles, returns their paths"""
+    LOGGER.info(
+        f"Profiling for {seconds}s",
+        extra=journal_context({"MESSAGE_ID": DATABRIDGE_PROFILE_STARTED}),
+    )
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+        sampler.stop()
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+        # snapshot processing is slow, it shouldn't block the event loop
+        paths = await asyncio.get_event_loop().run_in_executor(None, save, prefix, sampler.stacks, seconds)
+    finally:
+        sampler.stop()
+        if started_tracemalloc:
+            tracemalloc.stop()
+    metrics.inc("profiles_total")
+    LOGGER.info(
+        f"Profile saved to {paths['summary']}",
+        extra=journal_context({"MESSAGE_ID": DATABRIDGE_PROFILE_SAVED}, {"PATHS": list(paths.values())}),
+    )
+    return paths
+
+
+def start(seconds: float = PROFILE_SECONDS) -> bool:
+    """Starts a capture in the background, returns False if one is already running"""
+    global PROFILING
+    if PROFILING is not None and not PROFILING.done():
+        return False
+    PROFILING = asyncio.ensure_future(capture(seconds))
+    return True
+
+
+def install() -> None:
+    asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, start)
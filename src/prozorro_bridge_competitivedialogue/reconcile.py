@@ -0,0 +1,166 @@
+from aiohttp import ClientSession
+import argparse
+import asyncio
+import json
+import os
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    ERROR_INTERVAL,
+    ALLOWED_STATUSES,
+    REWRITE_STATUSES,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_PAGE_LIMIT,
+    RECONCILE_GRACE_PERIOD,
+    RECONCILE_CHECKPOINT_FILE,
+)
+from prozorro_bridge_competitivedialogue.utils import (
+    journal_context,
+    check_tender,
+    get_age,
+    BASE_URL,
+    HEADERS,
+)
+from prozorro_bridge_competitivedialogue.bridge import (
+    get_tender,
+    patch_new_tender_status,
+    patch_dialog_status,
+    process_tender,
+)
+from prozorro_bridge_competitivedialogue.scheduler import PriorityScheduler
+from prozorro_bridge_competitivedialogue.limiter import AdaptiveLimiter, LimitedSession
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_EXCEPTION,
+    DATABRIDGE_RECONCILE_PAGE,
+    DATABRIDGE_RECONCILE_PLAN,
+)
+
+
+OPT_FIELDS = "status,procurementMethodType,stage2TenderID"
+
+STEP_CREATE = "create"
+STEP_PATCH_STAGE2_STATUS = "patch_new_tender_status"
+STEP_PATCH_DIALOG_STATUS = "patch_dialog_status"
+
+
+def load_checkpoint() -> str:
+    if os.path.exists(RECONCILE_CHECKPOINT_FILE):
+        with open(RECONCILE_CHECKPOINT_FILE) as f:
+            return json.load(f).get("offset", "")
+    return ""
+
+
+def save_checkpoint(offset: str) -> None:
+    tmp_file = f"{RECONCILE_CHECKPOINT_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp_file, RECONCILE_CHECKPOINT_FILE)
+
+
+async def get_tenders_page(session: ClientSession, offset: str) -> dict:
+    params = {"opt_fields": OPT_FIELDS, "limit": RECONCILE_PAGE_LIMIT}
+    if offset:
+        params["offset"] = offset
+    while True:
+        try:
+            response = await session.get(f"{BASE_URL}/tenders", params=params, headers=HEADERS)
+            data = await response.text()
+            if response.status != 200:
+                raise ConnectionError(f"Error {data}")
+            return json.loads(data)
+        except Exception as e:
+            LOGGER.warning(
+                f"Fail to get tenders page with offset {offset}",
+                extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}),
+            )
+            LOGGER.exception(e)
+            await asyncio.sleep(ERROR_INTERVAL)
+
+
+def is_candidate(tender: dict) -> bool:
+    if not check_tender(tender):
+        return False
+    age = get_age(tender)
+    if age is not None and age < RECONCILE_GRACE_PERIOD:
+        # can't be stuck yet, the live bridge may be creating its stage 2 right now
+        metrics.inc("reconcile_recent_skips_total")
+        return False
+    return True
+
+
+async def plan_steps(tender: dict, session: ClientSession) -> list:
+    """Compares the dialogue and its stage 2 and returns the steps that are still missing"""
+    if "stage2TenderID" not in tender:
+        return [STEP_CREATE]
+    tender_stage2 = await get_tender(tender["stage2TenderID"], session)
+    if not tender_stage2:
+        return [STEP_CREATE]
+    if tender_stage2.get("status") in ALLOWED_STATUSES:
+        return [STEP_PATCH_DIALOG_STATUS]
+    if tender_stage2.get("status") in REWRITE_STATUSES and tender_stage2.get("dialogueID") == tender["id"]:
+        # stage 2 was created and linked to the dialogue but never activated
+        return [STEP_PATCH_STAGE2_STATUS, STEP_PATCH_DIALOG_STATUS]
+    return [STEP_CREATE]
+
+
+async def reconcile_tender(session: ClientSession, tender: dict) -> list:
+    steps = await plan_steps(tender, session)
+    LOGGER.info(
+        f"Reconcile dialogue {tender['id']}, missing steps: {steps}",
+        extra=journal_context(
+            {"MESSAGE_ID": DATABRIDGE_RECONCILE_PLAN},
+            {"TENDER_ID": tender["id"], "STEPS": steps}
+        ),
+    )
+    for step in steps:
+        metrics.inc("reconcile_steps_total", step=step)
+        if step == STEP_CREATE:
+            await process_tender(session, tender)
+        elif step == STEP_PATCH_STAGE2_STATUS:
+            await patch_new_tender_status({"id": tender["id"], "stage2TenderID": tender["stage2TenderID"]}, session)
+        elif step == STEP_PATCH_DIALOG_STATUS:
+            await patch_dialog_status(tender["id"], session)
+    return steps
+
+
+async def reconcile(session: ClientSession, offset: str = "") -> None:
+    scheduler = PriorityScheduler(reconcile_tender, concurrency=RECONCILE_CONCURRENCY)
+    page = await get_tenders_page(session, offset)
+    while page.get("data"):
+        candidates = [tender for tender in page["data"] if is_candidate(tender)]
+        futures = [scheduler.submit(session, tender) for tender in candidates]
+        next_offset = page["next_page"]["offset"]
+        # the next page is fetched while the current candidates are reconciled
+        _, page = await asyncio.gather(
+            asyncio.gather(*futures),
+            get_tenders_page(session, next_offset),
+        )
+        save_checkpoint(next_offset)
+        LOGGER.info(
+            f"Reconciled tenders page, {len(candidates)} candidates, next offset {next_offset}",
+            extra=journal_context(
+                {"MESSAGE_ID": DATABRIDGE_RECONCILE_PAGE},
+                {"OFFSET": next_offset, "CANDIDATES": len(candidates)}
+            ),
+        )
+    await scheduler.stop()
+
+
+def cli(args: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Find and fix competitive dialogues stuck in active.stage2.waiting")
+    parser.add_argument("--offset", help="feed offset to start from instead of the saved checkpoint")
+    parser.add_argument("--reset", action="store_true", help="ignore the saved checkpoint and start from the beginning")
+    args = parser.parse_args(args)
+
+    offset = args.offset or ("" if args.reset else load_checkpoint())
+
+    async def run():
+        async with ClientSession() as session:
+            await reconcile(LimitedSession(session, AdaptiveLimiter()), offset)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    cli()
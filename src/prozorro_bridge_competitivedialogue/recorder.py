@@ -0,0 +1,197 @@
+from collections import defaultdict, deque
+import argparse
+import asyncio
+import gzip
+import json
+import re
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from prozorro_bridge_competitivedialogue import metrics, dead_letter
+from prozorro_bridge_competitivedialogue.settings import LOGGER, HTTP_RECORD_FILE
+
+
+TOKEN_RE = re.compile(r'"(tender_token|dialogue_token)": "[^"]*"')
+
+
+def mask_secrets(text: str) -> str:
+    return TOKEN_RE.sub(lambda m: f'"{m.group(1)}": "{"0" * 32}"', text)
+
+
+class RecordedResponse:
+    __slots__ = ("status", "headers", "_body")
+
+    def __init__(self, status: int, body: str, headers: dict = None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body.encode()
+
+    async def text(self) -> str:
+        return self._body
+
+
+def get_request_json(kwargs: dict):
+    if "json" in kwargs:
+        return kwargs["json"]
+    body = kwargs.get("data")
+    if body is None:
+        return None
+    if kwargs.get("headers", {}).get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+class RecordingSession:
+    """
+    Proxies the bridge requests to the session and writes them to a gzipped json lines log.
+    Every entry is a separate gzip member, so the log stays readable when the process is killed
+    """
+
+    def __init__(self, session, path: str = HTTP_RECORD_FILE):
+        self.session = session
+        self.path = path
+        self.started = time.monotonic()
+        self.file = open(path, "ab")
+
+    def write(self, entry: dict) -> None:
+        self.file.write(gzip.compress((json.dumps(entry, separators=(",", ":")) + "\n").encode()))
+        self.file.flush()
+
+    def record_items(self, items: list) -> None:
+        self.write({"kind": "items", "t": round(time.monotonic() - self.started, 6), "items": items})
+
+    async def request(self, method: str, url: str, **kwargs) -> RecordedResponse:
+        start = time.monotonic()
+        response = await getattr(self.session, method.lower())(url, **kwargs)
+        body = await response.text()
+        elapsed = time.monotonic() - start
+        self.write({
+            "kind": "request",
+            "t": round(start - self.started, 6),
+            "method": method,
+            "url": url,
+            "params": kwargs.get("params"),
+            "json": json.loads(mask_secrets(json.dumps(get_request_json(kwargs)))),
+            "status": response.status,
+            "response": mask_secrets(body),
+            "elapsed": round(elapsed, 6),
+        })
+        return RecordedResponse(response.status, body, dict(getattr(response, "headers", {}) or {}))
+
+    async def get(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("PATCH", url, **kwargs)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_log(path: str) -> list:
+    """Reads the log entries, a tail truncated by a killed process is skipped"""
+    entries = []
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                entries.append(json.loads(line))
+        except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            LOGGER.warning(f"{path} is truncated after {len(entries)} entries: {e}")
+    return entries
+
+
+def get_subject(body) -> str:
+    """The dialogue or tender a request body is about, e.g. concurrent stage 2 POSTs differ only by it"""
+    data = (body or {}).get("data") or {}
+    return data.get("dialogueID") or data.get("id") or ""
+
+
+def request_key(method: str, url: str, params: dict = None, body=None) -> tuple:
+    # the path only, so the traffic can be replayed against another API_HOST
+    return (
+        method,
+        urlsplit(url).path,
+        json.dumps(params, sort_keys=True) if params else "",
+        get_subject(body) if method in ("POST", "PATCH") else "",
+    )
+
+
+class ReplaySession:
+    """
+    Serves the recorded responses instead of the API.
+    Requests are matched by the path, params and, for POST/PATCH, the dialogue in the body.
+    Responses for the same request are served in the recorded order, the last one is repeated when they run out.
+    Original response time is divided by speed, speed 0 disables the delays
+    """
+
+    def __init__(self, entries: list, speed: float = 1):
+        self.speed = speed
+        self.responses = defaultdict(deque)
+        for entry in entries:
+            if entry["kind"] == "request":
+                key = request_key(entry["method"], entry["url"], entry.get("params"), entry.get("json"))
+                self.responses[key].append(entry)
+
+    async def request(self, method: str, url: str, **kwargs) -> RecordedResponse:
+        responses = self.responses.get(request_key(method, url, kwargs.get("params"), get_request_json(kwargs)))
+        if not responses:
+            metrics.inc("replay_misses_total", method=method)
+            LOGGER.warning(f"No recorded response for {method} {url}")
+            return RecordedResponse(404, json.dumps({"errors": ["not recorded"]}))
+        entry = responses.popleft() if len(responses) > 1 else responses[0]
+        if self.speed:
+            await asyncio.sleep(entry["elapsed"] / self.speed)
+        return RecordedResponse(entry["status"], entry["response"])
+
+    async def get(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs) -> RecordedResponse:
+        return await self.request("PATCH", url, **kwargs)
+
+
+async def replay(entries: list, speed: float = 1) -> float:
+    """
+    Feeds the recorded feed pages to process_tender keeping their original (or accelerated) pace.
+    Dead letters of the run go to a temporary store, so they don't change the next replay or the bridge
+    """
+    from prozorro_bridge_competitivedialogue.bridge import process_tender
+
+    session = ReplaySession(entries, speed)
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    with dead_letter.isolated():
+        for entry in entries:
+            if entry["kind"] != "items":
+                continue
+            if speed:
+                delay = started + entry["t"] / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await asyncio.gather(*(process_tender(session, item) for item in entry["items"]))
+    return loop.time() - started
+
+
+def cli(args: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay API traffic recorded with HTTP_RECORD_FILE")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1, help="time acceleration, 0 replays without delays")
+    args = parser.parse_args(args)
+
+    duration = asyncio.run(replay(read_log(args.path), args.speed))
+    print(f"Replayed {args.path} in {duration:.3f}s")
+    print(metrics.render())
+
+
+if __name__ == "__main__":
+    cli()
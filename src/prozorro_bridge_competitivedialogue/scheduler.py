@@ -0,0 +1,96 @@
+from itertools import count
+from typing import Awaitable, Callable
+import asyncio
+import time
+
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.settings import (
+    SCHEDULER_CONCURRENCY,
+    SCHEDULER_STAGE2_BONUS,
+)
+
+
+def get_priority_bonus(tender: dict) -> float:
+    if "stage2TenderID" in tender:
+        # stage 2 already exists, usually only patches are left
+        return SCHEDULER_STAGE2_BONUS
+    return 0
+
+
+class PriorityScheduler:
+    """
+    Runs worker(session, tender) for submitted tenders with limited concurrency.
+    Tenders are ordered by their enqueue time minus the priority bonus,
+    that gives ageing for free: a queued tender can't be overtaken by a newer one forever
+    """
+
+    def __init__(self, worker: Callable[..., Awaitable], concurrency: int = SCHEDULER_CONCURRENCY):
+        self.worker = worker
+        self.concurrency = concurrency
+        self.queue = None
+        self.workers = []
+        self.counter = count()
+
+    def start(self) -> None:
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.ensure_future(self.run_worker()) for _ in range(self.concurrency)]
+
+    def submit(self, session, tender: dict, bonus: float = None) -> asyncio.Future:
+        if self.queue is None:
+            self.start()
+        if bonus is None:
+            bonus = get_priority_bonus(tender)
+        now = time.monotonic()
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((now - bonus, next(self.counter), now, session, tender, future))
+        metrics.set_gauge("scheduler_queue_size", self.queue.qsize())
+        return future
+
+    def resize(self, concurrency: int) -> None:
+        """Starts missing workers, extra ones stop after their current tender"""
+        self.concurrency = concurrency
+        if self.queue is not None:
+            while len(self.workers) < concurrency:
+                self.workers.append(asyncio.ensure_future(self.run_worker()))
+        metrics.set_gauge("scheduler_concurrency", concurrency)
+
+    async def run_worker(self) -> None:
+        while True:
+            if len(self.workers) > self.concurrency:
+                self.workers.remove(asyncio.current_task())
+                return
+            _, _, enqueued, session, tender, future = await self.queue.get()
+            metrics.set_gauge("scheduler_queue_size", self.queue.qsize())
+            metrics.observe("scheduler_wait_seconds", time.monotonic() - enqueued)
+            try:
+                result = await self.worker(session, tender)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    def drain_queue(self) -> list:
+        """Removes and returns tenders that are still waiting for a worker"""
+        tenders = []
+        while self.queue is not None and not self.queue.empty():
+            tenders.append(self.queue.get_nowait()[4])
+            self.queue.task_done()
+        metrics.set_gauge("scheduler_queue_size", 0)
+        return tenders
+
+    def cancel(self) -> list:
+        """Cancels the workers, none of them runs its tender any further after the call"""
+        for worker in self.workers:
+            worker.cancel()
+        return self.workers
+
+    async def stop(self) -> None:
+        await asyncio.gather(*self.cancel(), return_exceptions=True)
+        self.workers, self.queue = [], None
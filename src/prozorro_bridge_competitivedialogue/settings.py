@@ -3,10 +3,30 @@ from prozorro_crawler.settings import logger, PUBLIC_API_HOST
 
 LOGGER = logger
 
+# values that can't be converted, reported by validate_settings
+PARSE_ERRORS = []
+
+
+def get_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        PARSE_ERRORS.append(f"{name} should be an integer, got {os.environ[name]!r}")
+        return default
+
+
+def get_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        PARSE_ERRORS.append(f"{name} should be a number, got {os.environ[name]!r}")
+        return default
+
+
 API_HOST = os.environ.get("API_HOST", PUBLIC_API_HOST)
 API_TOKEN = os.environ.get("API_TOKEN", "competitive_dialogue_data_bridge")
 
-ERROR_INTERVAL = int(os.environ.get("ERROR_INTERVAL", 5))
+ERROR_INTERVAL = get_int("ERROR_INTERVAL", 5)
 
 JOURNAL_PREFIX = os.environ.get("JOURNAL_PREFIX", "JOURNAL_")
 
@@ -41,3 +61,106 @@ COPY_NAME_FIELDS = (
 STAGE_2_EU_TYPE = "competitiveDialogueEU.stage2"
 STAGE_2_UA_TYPE = "competitiveDialogueUA.stage2"
 STAGE2_STATUS = 'draft.stage2'
+
+LOOP_LAG_INTERVAL = get_float("LOOP_LAG_INTERVAL", 1)
+LOOP_LAG_THRESHOLD = get_float("LOOP_LAG_THRESHOLD", 0.1)
+SLOW_STEP_THRESHOLD = get_float("SLOW_STEP_THRESHOLD", 30)
+SLOW_CALLBACK_THRESHOLD = get_float("SLOW_CALLBACK_THRESHOLD", 0.1)
+
+# "console", "file" or empty to disable
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "")
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE", "traces.jsonl")
+
+DEAD_LETTER_DB = os.environ.get("DEAD_LETTER_DB", "dead_letters.sqlite")
+# seconds a failed dialogue is skipped for, 0 disables the negative cache
+DEAD_LETTER_TTL = get_int("DEAD_LETTER_TTL", 24 * 60 * 60)
+# seconds between re-reads of the store, so entries removed with the CLI are retried by the running bridge
+DEAD_LETTER_REFRESH_INTERVAL = get_float("DEAD_LETTER_REFRESH_INTERVAL", 60)
+
+SCHEDULER_CONCURRENCY = get_int("SCHEDULER_CONCURRENCY", 50)
+# the priority bonus is in seconds of queue waiting time, so any queued dialogue
+# outranks new ones after waiting at most that long
+SCHEDULER_STAGE2_BONUS = get_float("SCHEDULER_STAGE2_BONUS", 60)
+
+CREDENTIALS_CACHE_TTL = get_int("CREDENTIALS_CACHE_TTL", 600)
+# the oldest credentials are dropped when the cache is full
+CREDENTIALS_CACHE_SIZE = get_int("CREDENTIALS_CACHE_SIZE", 1000)
+CREDENTIALS_CACHE_ENCRYPT = os.environ.get("CREDENTIALS_CACHE_ENCRYPT", "").lower() in ("1", "true", "yes")
+
+RECONCILE_CONCURRENCY = get_int("RECONCILE_CONCURRENCY", 100)
+RECONCILE_PAGE_LIMIT = get_int("RECONCILE_PAGE_LIMIT", 1000)
+# dialogues modified less than this many seconds ago may be processed by the live bridge right now
+RECONCILE_GRACE_PERIOD = get_int("RECONCILE_GRACE_PERIOD", 60 * 60)
+RECONCILE_CHECKPOINT_FILE = os.environ.get("RECONCILE_CHECKPOINT_FILE", "reconcile_checkpoint.json")
+
+# record POST/PATCH requests to DRY_RUN_DB instead of sending them
+DRY_RUN = os.environ.get("DRY_RUN", "").lower() in ("1", "true", "yes")
+DRY_RUN_DB = os.environ.get("DRY_RUN_DB", "dry_run.sqlite")
+
+# gzip POST/PATCH bodies larger than REQUEST_GZIP_MIN_SIZE bytes, the API has to accept Content-Encoding: gzip
+REQUEST_GZIP = os.environ.get("REQUEST_GZIP", "").lower() in ("1", "true", "yes")
+REQUEST_GZIP_MIN_SIZE = get_int("REQUEST_GZIP_MIN_SIZE", 1024)
+
+# record every request made by the bridge with its response and timing, empty to disable
+HTTP_RECORD_FILE = os.environ.get("HTTP_RECORD_FILE", "")
+
+LIMITER_MIN = get_int("LIMITER_MIN", 5)
+LIMITER_MAX = get_int("LIMITER_MAX", 200)
+LIMITER_INITIAL = get_int("LIMITER_INITIAL", 20)
+LIMITER_WINDOW = get_int("LIMITER_WINDOW", 50)
+LIMITER_TOLERANCE = get_float("LIMITER_TOLERANCE", 1.5)
+LIMITER_BACKOFF = get_float("LIMITER_BACKOFF", 0.7)
+
+# status server with /healthz, /readyz, /status and /metrics, port 0 disables it
+STATUS_HOST = os.environ.get("STATUS_HOST", "0.0.0.0")
+STATUS_PORT = get_int("STATUS_PORT", 8080)
+# instance is reported dead when dialogues are in flight but no step has finished and no API request
+# has been retried for this long
+STATUS_STALL_TIMEOUT = get_int("STATUS_STALL_TIMEOUT", 15 * 60)
+MONGODB_URL = os.environ.get("MONGODB_URL", "")
+MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "prozorro_bridge_competitivedialogue")
+
+# seconds to let in-flight dialogues finish their current step after SIGTERM
+DRAIN_TIMEOUT = get_float("DRAIN_TIMEOUT", 20)
+# the checkpoint is kept in the MONGODB_URL collection when it's set, so a replacement instance can resume it,
+# otherwise DRAIN_CHECKPOINT_FILE has to be on a volume that outlives the container
+DRAIN_CHECKPOINT_FILE = os.environ.get("DRAIN_CHECKPOINT_FILE", "drain_checkpoint.json")
+DRAIN_CHECKPOINT_COLLECTION = os.environ.get("DRAIN_CHECKPOINT_COLLECTION", "drain_checkpoint")
+# seconds between checks for dialogues saved by another instance, e.g. the one replaced in a rolling deploy
+DRAIN_CHECKPOINT_POLL_INTERVAL = get_float("DRAIN_CHECKPOINT_POLL_INTERVAL", 30)
+# a saved dialogue is claimed by the instance resuming it, the claim is renewed every poll and taken over
+# by another instance when it's not renewed for this long, e.g. after a crash
+DRAIN_CHECKPOINT_CLAIM_TIMEOUT = get_float("DRAIN_CHECKPOINT_CLAIM_TIMEOUT", 10 * 60)
+
+# json or KEY=VALUE file with the settings changed at runtime, it's checked every CONFIG_RELOAD_INTERVAL seconds
+# and on SIGHUP, empty to disable
+CONFIG_FILE = os.environ.get("CONFIG_FILE", "")
+CONFIG_RELOAD_INTERVAL = get_float("CONFIG_RELOAD_INTERVAL", 5)
+
+# SIGUSR1 or POST /profile on the status server capture a sampling CPU profile and a tracemalloc snapshot
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SECONDS = get_float("PROFILE_SECONDS", 30)
+PROFILE_SAMPLE_INTERVAL = get_float("PROFILE_SAMPLE_INTERVAL", 0.005)
+
+
+def validate_settings() -> list:
+    errors = list(PARSE_ERRORS)
+    for name in ("ERROR_INTERVAL", "LOOP_LAG_INTERVAL", "SCHEDULER_CONCURRENCY", "RECONCILE_CONCURRENCY",
+                 "RECONCILE_PAGE_LIMIT", "DEAD_LETTER_REFRESH_INTERVAL", "CREDENTIALS_CACHE_SIZE", "LIMITER_MIN", "LIMITER_WINDOW", "REQUEST_GZIP_MIN_SIZE",
+                 "DRAIN_CHECKPOINT_POLL_INTERVAL", "CONFIG_RELOAD_INTERVAL", "PROFILE_SECONDS", "PROFILE_SAMPLE_INTERVAL"):
+        if globals()[name] <= 0:
+            errors.append(f"{name} should be positive")
+    if DRAIN_CHECKPOINT_CLAIM_TIMEOUT <= DRAIN_CHECKPOINT_POLL_INTERVAL:
+        errors.append("DRAIN_CHECKPOINT_CLAIM_TIMEOUT should be greater than DRAIN_CHECKPOINT_POLL_INTERVAL")
+    if RECONCILE_GRACE_PERIOD < 0:
+        errors.append("RECONCILE_GRACE_PERIOD should not be negative")
+    if not LIMITER_MIN <= LIMITER_INITIAL <= LIMITER_MAX:
+        errors.append("LIMITER_INITIAL should be between LIMITER_MIN and LIMITER_MAX")
+    if not 0 < LIMITER_BACKOFF < 1:
+        errors.append("LIMITER_BACKOFF should be between 0 and 1")
+    if TRACE_EXPORTER not in ("", "console", "file"):
+        errors.append("TRACE_EXPORTER should be one of: console, file")
+    if not 0 <= STATUS_PORT < 65536:
+        errors.append("STATUS_PORT should be a valid port number")
+    return errors
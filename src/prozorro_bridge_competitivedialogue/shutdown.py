@@ -0,0 +1,246 @@
+from typing import Awaitable, Callable
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+
+from prozorro_bridge_competitivedialogue import metrics, monitoring
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    DRAIN_TIMEOUT,
+    DRAIN_CHECKPOINT_FILE,
+    DRAIN_CHECKPOINT_COLLECTION,
+    DRAIN_CHECKPOINT_POLL_INTERVAL,
+    DRAIN_CHECKPOINT_CLAIM_TIMEOUT,
+    MONGODB_URL,
+    MONGODB_DATABASE,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import (
+    DATABRIDGE_DRAIN_STARTED,
+    DATABRIDGE_DRAIN_FINISHED,
+    DATABRIDGE_DRAIN_CHECKPOINT,
+    DATABRIDGE_RESUME_CHECKPOINT,
+)
+
+
+STEP_PROCESS = "process_tender"
+STAGE2_STEPS = ("patch_dialog_add_stage2_id", "patch_new_tender_status", "patch_dialog_status")
+
+DRAINING = False
+# dialogue id -> {"tender": feed item, "step": first step to run, "dialog": created stage 2 link}
+CHECKPOINT = {}
+# ids of the saved dialogues that are resumed by this instance
+RESUMING = set()
+# the owner of the claimed entries in the shared checkpoint
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+_collection = None
+
+
+def should_stop(tender: dict, step: str, dialog: dict = None) -> bool:
+    """Called between process_tender steps, saves the dialogue to the checkpoint while draining"""
+    if not DRAINING:
+        return False
+    CHECKPOINT[tender["id"]] = {"tender": tender, "step": step, "dialog": dialog}
+    metrics.inc("drain_checkpoints_total", step=step)
+    LOGGER.info(
+        f"Dialogue {tender['id']} stopped before {step} for shutdown",
+        extra=journal_context(
+            {"MESSAGE_ID": DATABRIDGE_DRAIN_CHECKPOINT},
+            {"TENDER_ID": tender["id"], "STEP": step}
+        ),
+    )
+    return True
+
+
+def pop_checkpoint(tender_id: str) -> dict:
+    entry = CHECKPOINT.pop(tender_id, None)
+    if entry:
+        LOGGER.info(
+            f"Resume dialogue {tender_id} from {entry['step']}",
+            extra=journal_context(
+                {"MESSAGE_ID": DATABRIDGE_RESUME_CHECKPOINT},
+                {"TENDER_ID": tender_id, "STEP": entry["step"]}
+            ),
+        )
+    return entry
+
+
+def get_interrupted_step(state: dict) -> str:
+    if not state["dialog"]:
+        # nothing is written yet, the dialogue can be processed from scratch
+        return STEP_PROCESS
+    if state["step"] in STAGE2_STEPS:
+        return state["step"]
+    return STAGE2_STEPS[0]
+
+
+def _get_collection():
+    global _collection
+    if _collection is None:
+        from pymongo import MongoClient
+        _collection = MongoClient(MONGODB_URL)[MONGODB_DATABASE][DRAIN_CHECKPOINT_COLLECTION]
+    return _collection
+
+
+def _write_file(entries: list) -> None:
+    tmp_file = f"{DRAIN_CHECKPOINT_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp_file, DRAIN_CHECKPOINT_FILE)
+
+
+def get_entry(doc: dict) -> dict:
+    return {key: value for key, value in doc.items() if key not in ("_id", "owner", "claimed")}
+
+
+def save_checkpoint(entries: list) -> None:
+    if not MONGODB_URL:
+        return _write_file(entries)
+    for entry in entries:
+        tender_id = entry["tender"]["id"]
+        # the saved entry has no owner, any instance can claim it
+        _get_collection().replace_one({"_id": tender_id}, dict(entry, _id=tender_id), upsert=True)
+
+
+def load_checkpoint() -> list:
+    """Returns the saved entries, they are kept until remove_checkpoint"""
+    if MONGODB_URL:
+        return [get_entry(doc) for doc in _get_collection().find()]
+    if not os.path.exists(DRAIN_CHECKPOINT_FILE):
+        return []
+    with open(DRAIN_CHECKPOINT_FILE) as f:
+        return json.load(f)
+
+
+def claim_checkpoint() -> list:
+    """
+    Returns the saved entries for this instance to resume. Shared checkpoint entries are claimed one by one,
+    so every entry is resumed by a single instance
+    """
+    if not MONGODB_URL:
+        return load_checkpoint()
+    entries = []
+    now = time.time()
+    while True:
+        doc = _get_collection().find_one_and_update(
+            {"$or": [{"owner": None}, {"claimed": {"$lt": now - DRAIN_CHECKPOINT_CLAIM_TIMEOUT}}]},
+            {"$set": {"owner": INSTANCE_ID, "claimed": now}},
+        )
+        if doc is None:
+            return entries
+        entries.append(get_entry(doc))
+
+
+def renew_claims(tender_ids: list) -> None:
+    if MONGODB_URL and tender_ids:
+        _get_collection().update_many(
+            {"_id": {"$in": tender_ids}, "owner": INSTANCE_ID},
+            {"$set": {"claimed": time.time()}},
+        )
+
+
+def remove_checkpoint(tender_ids: list) -> None:
+    if MONGODB_URL:
+        _get_collection().delete_many({"_id": {"$in": tender_ids}, "owner": INSTANCE_ID})
+        return
+    entries = [entry for entry in load_checkpoint() if entry["tender"]["id"] not in tender_ids]
+    if entries:
+        _write_file(entries)
+    elif os.path.exists(DRAIN_CHECKPOINT_FILE):
+        os.remove(DRAIN_CHECKPOINT_FILE)
+
+
+async def resume(submit: Callable[[dict], Awaitable]) -> int:
+    """
+    Submits the saved dialogues that aren't resumed yet. They are removed from the checkpoint
+    only when finished, so a crash right after the start doesn't lose them
+    """
+    loop = asyncio.get_event_loop()
+    entries = await loop.run_in_executor(None, claim_checkpoint)
+    entries = [entry for entry in entries if entry["tender"]["id"] not in RESUMING]
+    tender_ids = [entry["tender"]["id"] for entry in entries]
+    futures = []
+    for tender_id, entry in zip(tender_ids, entries):
+        RESUMING.add(tender_id)
+        CHECKPOINT[tender_id] = entry
+        futures.append(submit(entry["tender"]))
+    if futures:
+        asyncio.ensure_future(remove_when_finished(tender_ids, futures))
+    return len(futures)
+
+
+async def remove_when_finished(tender_ids: list, futures: list) -> None:
+    await asyncio.gather(*futures, return_exceptions=True)
+    RESUMING.difference_update(tender_ids)
+    if not DRAINING:
+        # while draining the unfinished ones are saved again
+        await asyncio.get_event_loop().run_in_executor(None, remove_checkpoint, tender_ids)
+
+
+async def watch_checkpoint(submit: Callable[[dict], Awaitable],
+                           interval: float = DRAIN_CHECKPOINT_POLL_INTERVAL) -> None:
+    """Resumes dialogues saved to the shared checkpoint after this instance has started"""
+    while True:
+        await asyncio.sleep(interval)
+        if DRAINING:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, renew_claims, list(RESUMING))
+            await resume(submit)
+        except Exception as e:
+            LOGGER.exception(e)
+
+
+async def block_while_draining() -> None:
+    """Keeps the feed page unconfirmed, so the crawler starts from it after restart"""
+    while DRAINING:
+        await asyncio.sleep(1)
+
+
+async def drain(scheduler, timeout: float = DRAIN_TIMEOUT) -> None:
+    global DRAINING
+    DRAINING = True
+    LOGGER.info(
+        f"Draining {len(monitoring.INFLIGHT)} dialogues in flight",
+        extra=journal_context({"MESSAGE_ID": DATABRIDGE_DRAIN_STARTED}),
+    )
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    for tender in scheduler.drain_queue():
+        CHECKPOINT.setdefault(tender["id"], {"tender": tender, "step": STEP_PROCESS, "dialog": None})
+    while monitoring.INFLIGHT and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+    # the workers are stopped before the snapshot, a dialogue can't move past its saved step
+    scheduler.cancel()
+    for tender_id, state in list(monitoring.INFLIGHT.items()):
+        if state["tender"] is not None:
+            step = get_interrupted_step(state)
+            CHECKPOINT[tender_id] = {"tender": state["tender"], "step": step, "dialog": state["dialog"]}
+            metrics.inc("drain_checkpoints_total", step=step)
+    await scheduler.stop()
+    entries = list(CHECKPOINT.values())
+    await loop.run_in_executor(None, save_checkpoint, entries)
+    LOGGER.info(
+        f"Drained, {len(entries)} dialogues saved to the checkpoint",
+        extra=journal_context({"MESSAGE_ID": DATABRIDGE_DRAIN_FINISHED}),
+    )
+
+
+async def drain_and_exit(scheduler) -> None:
+    try:
+        await drain(scheduler)
+    finally:
+        loop = asyncio.get_event_loop()
+        loop.remove_signal_handler(signal.SIGTERM)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def install(scheduler) -> None:
+    def handler():
+        if not DRAINING:
+            asyncio.ensure_future(drain_and_exit(scheduler))
+
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, handler)
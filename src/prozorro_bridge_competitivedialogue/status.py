@@ -0,0 +1,133 @@
+from aiohttp import web, ClientSession, ClientTimeout
+import asyncio
+import time
+
+from prozorro_bridge_competitivedialogue import metrics, monitoring
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    STATUS_HOST,
+    STATUS_PORT,
+    STATUS_STALL_TIMEOUT,
+    MONGODB_URL,
+    PROFILE_ENABLED,
+    PROFILE_SECONDS,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context, BASE_URL, HEADERS
+from prozorro_bridge_competitivedialogue.journal_msg_ids import DATABRIDGE_STATUS_SERVER_STARTED
+
+
+CHECK_TIMEOUT = 5
+
+
+def is_stalled() -> bool:
+    return bool(monitoring.INFLIGHT) and time.monotonic() - monitoring.LAST_PROGRESS > STATUS_STALL_TIMEOUT
+
+
+async def check_api(session: ClientSession) -> bool:
+    try:
+        response = await session.get(
+            f"{BASE_URL}/tenders",
+            params={"limit": 1},
+            headers=HEADERS,
+            timeout=ClientTimeout(total=CHECK_TIMEOUT),
+        )
+        return response.status == 200
+    except Exception:
+        return False
+
+
+def ping_mongodb() -> bool:
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=CHECK_TIMEOUT * 1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+    finally:
+        client.close()
+
+
+async def check_mongodb() -> bool:
+    return await asyncio.get_event_loop().run_in_executor(None, ping_mongodb)
+
+
+def get_status() -> dict:
+    now = time.monotonic()
+    return {
+        "uptime": round(now - monitoring.STARTED, 3),
+        "last_progress_age": round(now - monitoring.LAST_PROGRESS, 3),
+        "feed": dict(monitoring.FEED_POSITION),
+        "inflight": [
+            {
+                "id": tender_id,
+                "step": state["step"],
+                "age": round(now - state["started"], 3),
+                "step_age": round(now - state["step_started"], 3),
+            }
+            for tender_id, state in monitoring.INFLIGHT.items()
+        ],
+        "scheduler_queue_size": metrics.get_gauge("scheduler_queue_size"),
+        "limiter_limit": metrics.get_gauge("limiter_limit"),
+        "event_loop_lag": metrics.get_gauge("event_loop_lag_seconds"),
+    }
+
+
+async def liveness(request: web.Request) -> web.Response:
+    if is_stalled():
+        return web.json_response({"status": "stalled"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+async def readiness(request: web.Request) -> web.Response:
+    checks = {"api": await check_api(request.app["session"])}
+    if MONGODB_URL:
+        checks["mongodb"] = await check_mongodb()
+    return web.json_response(checks, status=200 if all(checks.values()) else 503)
+
+
+async def status(request: web.Request) -> web.Response:
+    return web.json_response(get_status())
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def profile(request: web.Request) -> web.Response:
+    from prozorro_bridge_competitivedialogue import profiler
+
+    try:
+        seconds = float(request.query.get("seconds", PROFILE_SECONDS))
+    except ValueError:
+        return web.json_response({"error": "seconds should be a number"}, status=400)
+    if not 0 < seconds <= 600:
+        return web.json_response({"error": "seconds should be between 0 and 600"}, status=400)
+    if not profiler.start(seconds):
+        return web.json_response({"error": "profiling is already running"}, status=409)
+    return web.json_response({"status": "started", "seconds": seconds, "directory": profiler.PROFILE_DIR}, status=202)
+
+
+def create_app(session: ClientSession) -> web.Application:
+    app = web.Application()
+    app["session"] = session
+    app.router.add_get("/healthz", liveness)
+    app.router.add_get("/readyz", readiness)
+    app.router.add_get("/status", status)
+    app.router.add_get("/metrics", metrics_view)
+    if PROFILE_ENABLED:
+        app.router.add_post("/profile", profile)
+    return app
+
+
+async def start_status_server(session: ClientSession) -> None:
+    if not STATUS_PORT:
+        return
+    runner = web.AppRunner(create_app(session), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, STATUS_HOST, STATUS_PORT).start()
+    LOGGER.info(
+        f"Status server is listening on {STATUS_HOST}:{STATUS_PORT}",
+        extra=journal_context({"MESSAGE_ID": DATABRIDGE_STATUS_SERVER_STARTED}),
+    )
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+import json
+import secrets
+import time
+
+from prozorro_bridge_competitivedialogue import monitoring
+from prozorro_bridge_competitivedialogue.settings import (
+    LOGGER,
+    TRACE_EXPORTER,
+    TRACE_EXPORT_FILE,
+)
+from prozorro_bridge_competitivedialogue.utils import journal_context
+from prozorro_bridge_competitivedialogue.journal_msg_ids import DATABRIDGE_TRACE_SPAN
+
+
+SERVICE_NAME = "prozorro-bridge-competitivedialogue"
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+CURRENT_SPAN: ContextVar = ContextVar("current_span", default=None)
+
+_export_file = None
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "status", "message")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: dict = None):
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.name = name
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.message = ""
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def to_otlp(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": 3 if self.parent_id else 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()
+            ],
+            "status": {"code": self.status, "message": self.message},
+        }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def export_span(span: Span) -> None:
+    global _export_file
+    if TRACE_EXPORTER == "console":
+        LOGGER.info(
+            f"Span {span.name} trace={span.trace_id} duration={span.duration:.3f}s attributes={span.attributes}",
+            extra=journal_context(
+                {"MESSAGE_ID": DATABRIDGE_TRACE_SPAN},
+                {"TRACE_ID": span.trace_id, "SPAN": span.name, "DURATION": round(span.duration, 6)}
+            ),
+        )
+    elif TRACE_EXPORTER == "file":
+        if _export_file is None:
+            _export_file = open(TRACE_EXPORT_FILE, "a")
+        # one OTLP/JSON ExportTraceServiceRequest per line, as the otel collector file exporter does
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp()]}],
+            }]
+        }
+        _export_file.write(json.dumps(request) + "\n")
+        _export_file.flush()
+
+
+@contextmanager
+def start_span(name: str, **attributes):
+    span = Span(name, parent=CURRENT_SPAN.get(), attributes=attributes)
+    token = CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status, span.message = STATUS_ERROR, repr(e)
+        raise
+    else:
+        if span.status == STATUS_UNSET:
+            span.status = STATUS_OK
+    finally:
+        span.end = time.time_ns()
+        CURRENT_SPAN.reset(token)
+        export_span(span)
+
+
+def traced(name: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with start_span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_span_attribute(key: str, value) -> None:
+    span = CURRENT_SPAN.get()
+    if span is not None:
+        span.attributes[key] = value
+
+
+def record_response(status: int) -> None:
+    set_span_attribute("http.status_code", status)
+
+
+def record_retry() -> None:
+    # the instance is busy retrying the API, that's not a stall of its own
+    monitoring.record_progress()
+    span = CURRENT_SPAN.get()
+    if span is not None:
+        span.attributes["retries"] = span.attributes.get("retries", 0) + 1
@@ -1,4 +1,8 @@
 from copy import deepcopy
+from datetime import datetime, timezone
+from typing import Optional
+import gzip
+import json
 
 from prozorro_crawler.settings import API_VERSION, CRAWLER_USER_AGENT
 
@@ -6,13 +10,17 @@ from prozorro_bridge_competitivedialogue.settings import (
     LOGGER,
     STAGE_2_EU_TYPE,
     STAGE_2_UA_TYPE,
-    COPY_NAME_FIELDS,
     API_HOST,
     API_TOKEN,
     JOURNAL_PREFIX,
+    REQUEST_GZIP,
+    REQUEST_GZIP_MIN_SIZE,
 )
+from prozorro_bridge_competitivedialogue import metrics
+from prozorro_bridge_competitivedialogue.models import Tender
 from prozorro_bridge_competitivedialogue.journal_msg_ids import (
     DATABRIDGE_FOUND_NOLOT,
+    DATABRIDGE_LOT_NOT_FOUND,
     DATABRIDGE_COPY_TENDER_ITEMS,
 )
 
@@ -23,8 +31,30 @@ HEADERS = {
     "Content-Type": "application/json",
     "Authorization": f"Bearer {API_TOKEN}",
     "User-Agent": CRAWLER_USER_AGENT,
+    "Accept-Encoding": "gzip, deflate",
 }
 
+GZIP_HEADERS = {**HEADERS, "Content-Encoding": "gzip"}
+
+
+def encode_body(data: dict) -> dict:
+    """Returns the request body and headers, the body is gzipped when REQUEST_GZIP is set and it's big enough"""
+    body = json.dumps({"data": data}).encode()
+    if REQUEST_GZIP and len(body) >= REQUEST_GZIP_MIN_SIZE:
+        return {"data": gzip.compress(body), "headers": GZIP_HEADERS}
+    return {"data": body, "headers": HEADERS}
+
+
+def count_bytes(operation: str, response, body: str, request_body: bytes = b"") -> None:
+    """
+    Counts request and response sizes on the wire,
+    the decoded response size is used if there is no Content-Length
+    """
+    content_length = response.headers.get("Content-Length")
+    response_size = int(content_length) if content_length is not None else len(body.encode())
+    metrics.inc("request_bytes_total", len(request_body), operation=operation)
+    metrics.inc("response_bytes_total", response_size, operation=operation)
+
 
 def journal_context(record: dict = None, params: dict = None) -> dict:
     if record is None:
@@ -36,22 +66,21 @@ def journal_context(record: dict = None, params: dict = None) -> dict:
     return record
 
 
-def get_bid_by_id(bids: list, bid_id: str) -> dict:
-    for bid in bids:
-        if bid["id"] == bid_id:
-            return bid
-
-
-def prepare_lot(orig_tender: dict, lot_id: str, items: list) -> dict:
-    lot = None
-    for tender_lot in orig_tender["lots"]:
-        if tender_lot["id"] == lot_id:
-            lot = tender_lot
-            break
+def prepare_lot(orig_tender: Tender, lot_id: str, items: list) -> dict:
+    lot = orig_tender.lots.get(lot_id)
+    if lot is None:
+        LOGGER.warning(
+            f"Qualification of dialogue {orig_tender.id} refers to missing lot {lot_id}, the lot is skipped",
+            extra=journal_context(
+                {"MESSAGE_ID": DATABRIDGE_LOT_NOT_FOUND},
+                {"TENDER_ID": orig_tender.id, "LOT_ID": lot_id}
+            ),
+        )
+        return {}
     if lot["status"] != "active":
         return {}
 
-    for item in orig_tender["items"]:
+    for item in orig_tender.items:
         try:
             if item["relatedLot"] == lot_id:
                 items.append(item)
@@ -60,11 +89,26 @@ def prepare_lot(orig_tender: dict, lot_id: str, items: list) -> dict:
     return lot
 
 
-def check_tender(tender: dict) -> bool:
-    if (
+def get_age(tender: dict) -> Optional[float]:
+    """Seconds since the tender dateModified, None if it's missing or invalid"""
+    try:
+        date_modified = datetime.fromisoformat(tender["dateModified"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if date_modified.tzinfo is None:
+        date_modified = date_modified.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - date_modified).total_seconds()
+
+
+def is_stage2_waiting(tender: dict) -> bool:
+    return (
         tender.get("procurementMethodType", "") in ("competitiveDialogueUA", "competitiveDialogueEU")
         and tender.get("status", "") == "active.stage2.waiting"
-    ):
+    )
+
+
+def check_tender(tender: dict) -> bool:
+    if is_stage2_waiting(tender):
         return True
     else:
         LOGGER.debug(
@@ -78,70 +122,68 @@ def check_tender(tender: dict) -> bool:
     return False
 
 
-def prepare_new_tender_data(tender: dict, credentials: dict) -> dict:
+def prepare_new_tender_data(tender: Tender, credentials: dict) -> dict:
     LOGGER.info(
-        f"Copy competitive dialogue data, id={tender['id']}",
+        f"Copy competitive dialogue data, id={tender.id}",
         extra=journal_context(
             {"MESSAGE_ID": DATABRIDGE_COPY_TENDER_ITEMS},
-            {"TENDER_ID": tender["id"]})
+            {"TENDER_ID": tender.id})
     )
     new_tender = {
         "procurementMethod": "selective",
         "status": "draft",
-        "dialogueID": tender["id"]
+        "dialogueID": tender.id
     }
 
-    for field_name in COPY_NAME_FIELDS:
-        if field_name in tender:
-            new_tender[field_name] = tender[field_name]
-    if tender["procurementMethodType"].endswith("EU"):
+    new_tender.update(tender.copy_fields)
+    if tender.procurement_method_type.endswith("EU"):
         new_tender["procurementMethodType"] = STAGE_2_EU_TYPE
     else:
         new_tender["procurementMethodType"] = STAGE_2_UA_TYPE
-    new_tender["tenderID"] = f"{tender['tenderID']}.2"
+    new_tender["tenderID"] = f"{tender.tender_id}.2"
 
     old_lots = process_qualifications(tender, new_tender)
-    if "features" in tender:
-        process_features(new_tender, tender["features"], old_lots)
+    if tender.features is not None:
+        process_features(new_tender, tender.features, old_lots)
 
     new_tender["owner"] = credentials["owner"]
     new_tender["dialogue_token"] = credentials["tender_token"]
     return new_tender
 
 
-def process_qualifications(tender: dict, new_tender: dict) -> dict:
+def process_qualifications(tender: Tender, new_tender: dict) -> dict:
     old_lots, items, short_listed_firms = {}, [], {}
-    for qualification in tender["qualifications"]:
-        if qualification["status"] == "active":
-            bid = get_bid_by_id(tender["bids"], qualification["bidID"])
-            if qualification.get("lotID"):
-                if qualification["lotID"] not in old_lots:
-                    lot = prepare_lot(tender, qualification["lotID"], items)
+    for qualification in tender.qualifications:
+        if qualification.status == "active":
+            bid = tender.bids[qualification.bid_id]
+            if qualification.lot_id:
+                if qualification.lot_id not in old_lots:
+                    lot = prepare_lot(tender, qualification.lot_id, items)
                     if not lot:
                         continue
-                    old_lots[qualification["lotID"]] = lot
-                for bid_tender in bid["tenderers"]:
-                    if bid_tender["identifier"]["id"] not in short_listed_firms:
+                    old_lots[qualification.lot_id] = lot
+                for bid_tender in bid.tenderers:
+                    if bid_tender.identifier["id"] not in short_listed_firms:
                         identifier = {
-                            "name": bid_tender["name"],
-                            "identifier": bid_tender["identifier"],
-                            "lots": [{"id": old_lots[qualification["lotID"]]["id"]}]
+                            "name": bid_tender.name,
+                            "identifier": bid_tender.identifier,
+                            "lots": [{"id": old_lots[qualification.lot_id]["id"]}]
                         }
-                        short_listed_firms[bid_tender["identifier"]["id"]] = identifier
+                        short_listed_firms[bid_tender.identifier["id"]] = identifier
                     else:
-                        short_listed_firms[bid_tender["identifier"]["id"]]["lots"].append(
-                            {"id": old_lots[qualification["lotID"]]["id"]}
+                        short_listed_firms[bid_tender.identifier["id"]]["lots"].append(
+                            {"id": old_lots[qualification.lot_id]["id"]}
                         )
             else:
-                new_tender["items"] = deepcopy(tender["items"])
-                for bid_tender in bid["tenderers"]:
-                    if bid_tender["identifier"]["id"] not in short_listed_firms:
+                new_tender["items"] = deepcopy(list(tender.items))
+                for bid_tender in bid.tenderers:
+                    if bid_tender.identifier["id"] not in short_listed_firms:
                         identifier = {
-                            "name": bid_tender["name"],
-                            "identifier": bid_tender["identifier"],
+                            "name": bid_tender.name,
+                            "identifier": bid_tender.identifier,
                             "lots": []
                         }
-                        short_listed_firms[bid_tender["identifier"]["id"]] = identifier
+                        short_listed_firms[bid_tender.identifier["id"]] = identifier
     new_tender["shortlistedFirms"] = list(short_listed_firms.values())
     new_tender["lots"] = list(old_lots.values())
     if items:
@@ -149,7 +191,7 @@ def process_qualifications(tender: dict, new_tender: dict) -> dict:
     return old_lots
 
 
-def process_features(new_tender: dict, features: list, old_lots: dict) -> None:
+def process_features(new_tender: dict, features: tuple, old_lots: dict) -> None:
     new_tender["features"] = []
     for feature in features:
         if feature["featureOf"] == "tenderer":
@@ -159,4 +201,4 @@ def process_features(new_tender: dict, features: list, old_lots: dict) -> None:
                 new_tender["features"].append(feature)
         elif feature["featureOf"] == "lot":
             if feature["relatedItem"] in old_lots.keys():
-                new_tender["features"].append(feature)
\ No newline at end of file
+                new_tender["features"].append(feature)
@@ -1,4 +1,11 @@
+from datetime import datetime, timezone
+import asyncio
+import gzip
+import importlib
 import json
+import os
+import time
+import tracemalloc
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 
@@ -13,6 +20,29 @@ from prozorro_bridge_competitivedialogue.bridge import (
     process_tender,
 )
 from prozorro_bridge_competitivedialogue.utils import prepare_new_tender_data
+from prozorro_bridge_competitivedialogue import utils
+from prozorro_bridge_competitivedialogue.models import Tender
+from prozorro_bridge_competitivedialogue.limiter import AdaptiveLimiter, LimitedSession
+from prozorro_bridge_competitivedialogue.monitoring import (
+    INFLIGHT,
+    track_dialogue,
+    step_timer,
+    measure_loop_lag,
+)
+from prozorro_bridge_competitivedialogue.scheduler import PriorityScheduler, get_priority_bonus
+from prozorro_bridge_competitivedialogue import reconcile, recorder, status, shutdown
+from prozorro_bridge_competitivedialogue import monitoring
+from prozorro_bridge_competitivedialogue import metrics, tracing, dead_letter, credentials_cache, dry_run
+from prozorro_bridge_competitivedialogue import settings, import_time, config, profiler
+
+
+@pytest.fixture(autouse=True)
+def dead_letter_db(tmp_path):
+    with patch.multiple(dead_letter, DEAD_LETTER_DB=str(tmp_path / "dead_letters.sqlite"), _cache=None,
+                        _connection=None):
+        yield
+        dead_letter.close()
+    credentials_cache.clear()
 
 
 @pytest.fixture
@@ -393,7 +423,7 @@ async def test_process_tender_without_stage2(mocked_logger, tender_data, credent
 
 @patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
 def test_prepare_new_tender_data_with_lots_and_bids_positive(tender_data, credentials):
-    data = prepare_new_tender_data(tender_data, credentials["data"])
+    data = prepare_new_tender_data(Tender.from_dict(tender_data), credentials["data"])
 
     assert data["tenderID"].endswith(".2")
     assert data["procurementMethod"] == "selective"
@@ -411,7 +441,7 @@ def test_prepare_new_tender_data_with_lots_and_bids_without_features(tender_data
     tender_data["qualifications"][1]["status"] = "pending"
     del tender_data["features"]
 
-    data = prepare_new_tender_data(tender_data, credentials["data"])
+    data = prepare_new_tender_data(Tender.from_dict(tender_data), credentials["data"])
 
     assert data["tenderID"].endswith(".2")
     assert data["procurementMethod"] == "selective"
@@ -425,7 +455,7 @@ def test_prepare_new_tender_data_with_lots_and_bids_without_features(tender_data
 @patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
 def test_prepare_new_tender_data_with_lots_and_bids_no_active_lots(tender_data, credentials):
     tender_data["lots"][0]["status"] = "pending"
-    data = prepare_new_tender_data(tender_data, credentials["data"])
+    data = prepare_new_tender_data(Tender.from_dict(tender_data), credentials["data"])
 
     assert data["tenderID"].endswith(".2")
     assert data["procurementMethod"] == "selective"
@@ -434,3 +464,955 @@ def test_prepare_new_tender_data_with_lots_and_bids_no_active_lots(tender_data,
     assert data["lots"] == []
     assert all(i in data for i in ("shortlistedFirms", "owner", "dialogue_token"))
     assert all(i not in data for i in ("id", "bids", "qualifications"))
+
+
+@patch("prozorro_bridge_competitivedialogue.monitoring.LOGGER")
+def test_step_timer_flags_slow_step(mocked_logger):
+    metrics.reset()
+    with patch("prozorro_bridge_competitivedialogue.monitoring.time.monotonic", side_effect=[0, 1, 5]):
+        with track_dialogue("33"):
+            with step_timer("get_tender", "33", threshold=2):
+                assert INFLIGHT["33"]["step"] == "get_tender"
+    assert "33" not in INFLIGHT
+    assert metrics.get_counter("slow_steps_total", step="get_tender") == 1
+    assert metrics.get_histogram("process_tender_step_seconds", step="get_tender")["count"] == 1
+    assert mocked_logger.warning.call_count == 1
+    assert mocked_logger.warning.call_args.kwargs["extra"]["JOURNAL_TENDER_ID"] == "33"
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.monitoring.LOGGER")
+async def test_measure_loop_lag(mocked_logger):
+    metrics.reset()
+    with track_dialogue("33"):
+        with step_timer("prepare_new_tender_data", "33"):
+            with patch("prozorro_bridge_competitivedialogue.monitoring.LOOP_LAG_THRESHOLD", -1):
+                lag = await measure_loop_lag(0)
+    assert lag >= 0
+    assert metrics.get_counter("event_loop_stalls_total") == 1
+    assert mocked_logger.warning.call_count == 1
+    assert mocked_logger.warning.call_args.kwargs["extra"]["JOURNAL_INFLIGHT"] == ["33"]
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+async def test_process_tender_trace_spans(tmp_path, error_data):
+    tender_data = {
+        "id": "33",
+        "procurementMethodType": "competitiveDialogueUA",
+        "status": "active.stage2.waiting",
+        "stage2TenderID": "35"
+    }
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"id": "35", "status": "complete"}}))),
+    ])
+    session_mock.patch = AsyncMock(side_effect=[
+        MagicMock(status=412, text=AsyncMock(return_value=error_data)),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"stage2TenderID": "35"}}))),
+    ])
+    export_file = tmp_path / "traces.jsonl"
+    with patch.multiple(tracing, TRACE_EXPORTER="file", TRACE_EXPORT_FILE=str(export_file), _export_file=None):
+        with patch("prozorro_bridge_competitivedialogue.bridge.asyncio.sleep", AsyncMock()):
+            await process_tender(session_mock, tender_data)
+        tracing._export_file.close()
+
+    spans = [
+        json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        for line in export_file.read_text().splitlines()
+    ]
+    spans = {span["name"]: span for span in spans}
+    assert set(spans) == {"get_tender", "patch_dialog_status", "process_tender"}
+    assert len({span["traceId"] for span in spans.values()}) == 1
+    assert spans["get_tender"]["parentSpanId"] == spans["process_tender"]["spanId"]
+    attributes = {a["key"]: a["value"] for a in spans["patch_dialog_status"]["attributes"]}
+    assert attributes["http.status_code"] == {"intValue": "200"}
+    assert attributes["retries"] == {"intValue": "1"}
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2", AsyncMock(return_value={}))
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+async def test_process_tender_dead_letter_skip(tender_data, credentials):
+    tender_data["status"] = "active.stage2.waiting"
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps(credentials))),
+    ])
+    await process_tender(session_mock, tender_data)
+    await process_tender(session_mock, tender_data)
+
+    assert session_mock.get.await_count == 2
+    entry = dead_letter.get(tender_data["id"])
+    assert entry["reason"] == dead_letter.REASON_CREATE_REJECTED
+    assert entry["attempts"] == 1
+
+    dead_letter.remove(tender_data["id"])
+    assert dead_letter.is_dead(tender_data) is False
+
+
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+def test_dead_letter_modified_dialogue():
+    tender = {"id": "33", "dateModified": "2021-01-01T10:00:00+02:00"}
+    dead_letter.add(tender, dead_letter.REASON_CREATE_REJECTED)
+    assert dead_letter.is_dead(tender) is True
+    assert dead_letter.is_dead({"id": "33", "dateModified": "2021-01-01T08:30:00+00:00"}) is False
+    assert dead_letter.is_dead({"id": "33", "dateModified": "2021-01-01T07:30:00+00:00"}) is True
+    assert dead_letter.is_dead({"id": "33"}) is True
+
+
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+def test_dead_letter_removed_by_another_process():
+    import sqlite3
+
+    tender = {"id": "33", "dateModified": "2021-01-01T10:00:00+02:00"}
+    dead_letter.add(tender, dead_letter.REASON_CREATE_REJECTED)
+    connection = dead_letter._get_connection()
+    assert dead_letter.is_dead(tender) is True
+    # the CLI removes the entry with its own connection
+    with sqlite3.connect(dead_letter.DEAD_LETTER_DB) as cli_connection:
+        cli_connection.execute("DELETE FROM dead_letters WHERE tender_id = '33'")
+    cli_connection.close()
+    assert dead_letter.is_dead(tender) is True
+    with patch.object(dead_letter, "DEAD_LETTER_REFRESH_INTERVAL", 0):
+        assert dead_letter.is_dead(tender) is False
+    assert dead_letter._get_connection() is connection
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2")
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+async def test_process_tender_dead_letter_missing_related_lot(mocked_create, tender_data, credentials, capsys):
+    tender_data["status"] = "active.stage2.waiting"
+    del tender_data["items"][0]["relatedLot"]
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps(credentials))),
+    ])
+    await process_tender(session_mock, tender_data)
+
+    assert mocked_create.await_count == 0
+    assert dead_letter.get(tender_data["id"])["reason"] == dead_letter.REASON_MISSING_RELATED_LOT
+    dead_letter.cli(["list"])
+    assert capsys.readouterr().out.startswith(f"{tender_data['id']}\t{dead_letter.REASON_MISSING_RELATED_LOT}")
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2")
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+async def test_process_tender_dead_letter_missing_bid(mocked_create, tender_data):
+    tender_data["status"] = "active.stage2.waiting"
+    del tender_data["bids"][0]
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+    ])
+    await process_tender(session_mock, tender_data)
+
+    assert mocked_create.await_count == 0
+    entry = dead_letter.get(tender_data["id"])
+    assert entry["reason"] == dead_letter.REASON_INVALID_TENDER
+    assert "bid_1" in entry["details"]
+
+
+def test_get_priority_bonus():
+    assert get_priority_bonus({"id": "33"}) == 0
+    assert get_priority_bonus({"id": "33", "stage2TenderID": "34"}) == 60
+
+
+@pytest.mark.asyncio
+async def test_priority_scheduler_order():
+    processed = []
+
+    async def worker(session, tender):
+        processed.append(tender["id"])
+        if tender["id"] == "fail":
+            raise ValueError(tender["id"])
+        return tender["id"]
+
+    scheduler = PriorityScheduler(worker, concurrency=1)
+    futures = [
+        scheduler.submit(None, {"id": "new"}),
+        scheduler.submit(None, {"id": "fail"}),
+        scheduler.submit(None, {"id": "stage2", "stage2TenderID": "34"}),
+    ]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    await scheduler.stop()
+
+    assert processed == ["stage2", "new", "fail"]
+    assert results[0] == "new"
+    assert isinstance(results[1], ValueError)
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2", AsyncMock(side_effect=[{}, {"id": "35"}]))
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_dialog_add_stage2_id", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_new_tender_status", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_dialog_status", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.credentials_cache.CREDENTIALS_CACHE_TTL", 60)
+async def test_process_tender_credentials_cache(tender_data, credentials):
+    tender_data["status"] = "active.stage2.waiting"
+    tender_data["dateModified"] = "2021-01-01T10:00:00+02:00"
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps(credentials))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+    ])
+    await process_tender(session_mock, tender_data)
+    assert dead_letter.is_dead(tender_data)
+    # renewed for CREDENTIALS_CACHE_TTL, not for the dead letter lifetime
+    assert time.monotonic() < credentials_cache._cache[tender_data["id"]][0] <= time.monotonic() + 60
+    assert credentials_cache.get(tender_data["id"]) == credentials["data"]
+
+    # the dialogue is fixed by its owner and comes back in the feed
+    await process_tender(session_mock, dict(tender_data, dateModified="2021-01-02T10:00:00+02:00"))
+    assert session_mock.get.await_count == 3
+    assert credentials_cache.get(tender_data["id"]) is None
+
+
+@patch("prozorro_bridge_competitivedialogue.credentials_cache.CREDENTIALS_CACHE_SIZE", 2)
+def test_credentials_cache_size(credentials):
+    for tender_id in ("33", "34", "35"):
+        credentials_cache.put(tender_id, credentials["data"])
+    assert list(credentials_cache._cache) == ["34", "35"]
+    credentials_cache.renew("34")
+    credentials_cache.put("36", credentials["data"])
+    assert list(credentials_cache._cache) == ["34", "36"]
+
+
+@patch("prozorro_bridge_competitivedialogue.credentials_cache.CREDENTIALS_CACHE_ENCRYPT", True)
+def test_credentials_cache_encrypted(credentials):
+    pytest.importorskip("cryptography")
+    credentials_cache.put("33", credentials["data"])
+    assert credentials["data"]["tender_token"].encode() not in credentials_cache._cache["33"][1]
+    assert credentials_cache.get("33") == credentials["data"]
+    credentials_cache.invalidate("33")
+    assert credentials_cache.get("33") is None
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+async def test_reconcile_plan_steps():
+    tender = {"id": "33", "stage2TenderID": "34"}
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=404, text=AsyncMock(return_value="")),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"status": "complete"}}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"status": "draft", "dialogueID": "33"}}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"status": "draft", "dialogueID": "1"}}))),
+    ])
+    assert await reconcile.plan_steps({"id": "33"}, session_mock) == [reconcile.STEP_CREATE]
+    assert await reconcile.plan_steps(tender, session_mock) == [reconcile.STEP_CREATE]
+    assert await reconcile.plan_steps(tender, session_mock) == [reconcile.STEP_PATCH_DIALOG_STATUS]
+    assert await reconcile.plan_steps(tender, session_mock) == [
+        reconcile.STEP_PATCH_STAGE2_STATUS, reconcile.STEP_PATCH_DIALOG_STATUS
+    ]
+    assert await reconcile.plan_steps(tender, session_mock) == [reconcile.STEP_CREATE]
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.reconcile.patch_new_tender_status")
+@patch("prozorro_bridge_competitivedialogue.reconcile.patch_dialog_status")
+@patch("prozorro_bridge_competitivedialogue.reconcile.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+async def test_reconcile_pages(mocked_patch_dialog_status, mocked_patch_new_tender_status, tmp_path):
+    page = {
+        "data": [
+            {"id": "33", "procurementMethodType": "competitiveDialogueUA",
+             "status": "active.stage2.waiting", "stage2TenderID": "34"},
+            {"id": "36", "procurementMethodType": "competitiveDialogueUA", "status": "complete"},
+            {"id": "37", "procurementMethodType": "competitiveDialogueUA", "status": "active.stage2.waiting",
+             "dateModified": datetime.now(timezone.utc).isoformat()},
+        ],
+        "next_page": {"offset": "1.5"},
+    }
+    metrics.reset()
+    session_mock = AsyncMock()
+    responses = {
+        "1": page,
+        "1.5": {"data": [], "next_page": {"offset": "2"}},
+        "34": {"data": {"status": "draft", "dialogueID": "33"}},
+    }
+
+    async def get(url, params=None, **kwargs):
+        key = params["offset"] if params else url.rsplit("/", 1)[-1]
+        return MagicMock(status=200, text=AsyncMock(return_value=json.dumps(responses[key])))
+
+    session_mock.get = AsyncMock(side_effect=get)
+    checkpoint = tmp_path / "checkpoint.json"
+    with patch("prozorro_bridge_competitivedialogue.reconcile.RECONCILE_CHECKPOINT_FILE", str(checkpoint)):
+        await reconcile.reconcile(session_mock, "1")
+        assert reconcile.load_checkpoint() == "1.5"
+
+    assert session_mock.get.await_count == 3
+    mocked_patch_new_tender_status.assert_awaited_once_with({"id": "33", "stage2TenderID": "34"}, session_mock)
+    mocked_patch_dialog_status.assert_awaited_once_with("33", session_mock)
+    assert metrics.get_counter("reconcile_recent_skips_total") == 1
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.DRY_RUN", True)
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dry_run.LOGGER", MagicMock())
+async def test_process_tender_dry_run(tender_data, credentials, tmp_path):
+    tender_data["status"] = "active.stage2.waiting"
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps(credentials))),
+    ])
+    with patch("prozorro_bridge_competitivedialogue.dry_run.DRY_RUN_DB", str(tmp_path / "dry_run.sqlite")):
+        await process_tender(session_mock, tender_data)
+        intents = dry_run.list_intents()
+
+    assert session_mock.post.await_count == 0
+    assert session_mock.patch.await_count == 0
+    assert [intent["operation"] for intent in intents] == [
+        "create_tender_stage2", "patch_dialog_add_stage2_id", "patch_new_tender_status", "patch_dialog_status",
+    ]
+    payload = intents[0]["payload"]["data"]
+    assert payload["dialogue_token"] == "***"
+    assert intents[1]["payload"]["data"] == {"id": "33", "stage2TenderID": "dry-run-33"}
+    assert dry_run.diff_payload(payload, dict(payload, title="changed", owner="user2")) == {
+        "title": {"dry_run": "test_tender", "production": "changed"}
+    }
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+async def test_record_and_replay(tmp_path):
+    tender_data = {
+        "id": "33",
+        "procurementMethodType": "competitiveDialogueUA",
+        "status": "active.stage2.waiting",
+        "stage2TenderID": "35"
+    }
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"id": "35", "status": "complete"}}))),
+    ])
+    session_mock.patch = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": {"stage2TenderID": "35"}}))),
+    ])
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recording_session = recorder.RecordingSession(session_mock, path)
+    recording_session.record_items([tender_data])
+    await process_tender(recording_session, tender_data)
+    recording_session.close()
+
+    entries = recorder.read_log(path)
+    assert [(e["kind"], e.get("method"), e.get("status")) for e in entries] == [
+        ("items", None, None), ("request", "GET", 200), ("request", "PATCH", 200),
+    ]
+
+    metrics.reset()
+    await recorder.replay(entries, speed=0)
+    assert metrics.get_counter("replay_misses_total", method="GET") == 0
+    assert metrics.get_counter("replay_misses_total", method="PATCH") == 0
+    assert metrics.get_histogram("process_tender_step_seconds", step="patch_dialog_status")["count"] == 1
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.recorder.LOGGER", MagicMock())
+async def test_recorder_killed_process(tmp_path):
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(return_value=MagicMock(status=200, text=AsyncMock(return_value="{}")))
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recording_session = recorder.RecordingSession(session_mock, path)
+    await recording_session.get("http://api-a/api/2.5/tenders/33")
+    await recording_session.get("http://api-a/api/2.5/tenders/34")
+    # the process is killed while the next entry is written
+    recording_session.file.write(gzip.compress(b'{"kind":"request"}\n')[:10])
+    recording_session.file.flush()
+
+    entries = recorder.read_log(path)
+    assert [entry["url"] for entry in entries] == ["http://api-a/api/2.5/tenders/33", "http://api-a/api/2.5/tenders/34"]
+    replay_session = recorder.ReplaySession(entries, speed=0)
+    assert (await replay_session.get("http://api-b/api/2.5/tenders/34")).status == 200
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.recorder.LOGGER", MagicMock())
+async def test_replay_matches_requests_by_dialogue():
+    def entry(dialogue_id: str, response: dict) -> dict:
+        return {
+            "kind": "request", "method": "POST", "url": "http://api/api/2.5/tenders", "params": None,
+            "json": {"data": {"dialogueID": dialogue_id}}, "status": 201,
+            "response": json.dumps(response), "elapsed": 0,
+        }
+
+    replay_session = recorder.ReplaySession([entry("33", {"id": "34"}), entry("36", {"id": "37"})], speed=0)
+    # concurrent dialogues post in another order than recorded
+    response = await replay_session.post("http://api/api/2.5/tenders", json={"data": {"dialogueID": "36"}})
+    assert json.loads(await response.text()) == {"id": "37"}
+    response = await replay_session.post("http://api/api/2.5/tenders", json={"data": {"dialogueID": "33"}})
+    assert json.loads(await response.text()) == {"id": "34"}
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+async def test_replay_doesnt_use_dead_letters(tender_data):
+    dead_letter.add(tender_data, dead_letter.REASON_CREATE_REJECTED)
+    entries = [{"kind": "items", "t": 0, "items": [tender_data]}]
+    calls = []
+
+    async def process_tender(session, tender):
+        calls.append(dead_letter.is_dead(tender))
+        dead_letter.add(tender, dead_letter.REASON_CREATE_REJECTED)
+
+    with patch("prozorro_bridge_competitivedialogue.bridge.process_tender", process_tender):
+        await recorder.replay(entries, speed=0)
+        await recorder.replay(entries, speed=0)
+    assert calls == [False, False]
+    assert dead_letter.get(tender_data["id"])["attempts"] == 1
+
+
+def test_recorder_mask_secrets(credentials):
+    masked = recorder.mask_secrets(json.dumps({"data": dict(credentials["data"], tender_token="secret")}))
+    assert json.loads(masked)["data"]["tender_token"] == "0" * 32
+
+
+def test_tender_from_dict(tender_data):
+    tender_data["bids"].append({"id": "bid_3", "tenderers": [], "documents": [{"id": "doc_1"}]})
+    tender_data["documents"] = [{"id": "doc_2"}]
+    tender = Tender.from_dict(tender_data)
+
+    assert tender.id == "33"
+    assert tender.copy_fields["title"] == "test_tender"
+    assert "documents" not in tender.copy_fields
+    assert set(tender.bids) == {"bid_1", "bid_2"}
+    assert tender.bids["bid_1"].tenderers[0].identifier == {"id": "id_1"}
+    assert tender.qualifications[0].lot_id == "lot_1"
+    assert tender.qualifications[1].lot_id is None
+    assert len(tender.features) == 3
+    assert not hasattr(tender, "__dict__")
+
+    tender_data["qualifications"][0]["bidID"] = "bid_4"
+    with pytest.raises(KeyError, match="bid_4"):
+        Tender.from_dict(tender_data)
+
+
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER")
+def test_prepare_new_tender_data_missing_lot(mocked_logger, tender_data, credentials):
+    tender_data["qualifications"][0]["lotID"] = "lot_4"
+    data = prepare_new_tender_data(Tender.from_dict(tender_data), credentials["data"])
+
+    assert "lot_4" not in [lot["id"] for lot in data["lots"]]
+    messages = [call.kwargs["extra"]["MESSAGE_ID"] for call in mocked_logger.warning.call_args_list]
+    assert messages == ["cd_bridge_lot_not_found"]
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2")
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.dead_letter.LOGGER", MagicMock())
+async def test_process_tender_invalid_tender(mocked_create, tender_data):
+    tender_data["status"] = "active.stage2.waiting"
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=404, text=AsyncMock(return_value="")),
+    ])
+    await process_tender(session_mock, tender_data)
+
+    assert session_mock.get.await_count == 1
+    assert mocked_create.await_count == 0
+    assert dead_letter.get(tender_data["id"])["reason"] == dead_letter.REASON_INVALID_TENDER
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.limiter.LOGGER", MagicMock())
+async def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(min_limit=2, max_limit=12, initial=10, window=2, tolerance=1.5, backoff=0.5)
+    for latency in (0.1, 0.1, 0.1, 0.12):
+        await limiter.acquire()
+        await limiter.release(latency, overload=False)
+    # the limit isn't reached, so it isn't raised
+    assert int(limiter.limit) == 10
+
+    for _ in range(10):
+        await limiter.acquire()
+    for _ in range(2):
+        await limiter.release(0.1, overload=False)
+    assert int(limiter.limit) == 11
+    for _ in range(8):
+        await limiter.release(0.1, overload=False)
+    assert int(limiter.limit) == 11
+
+    await limiter.acquire()
+    await limiter.release(0.1, overload=False)
+    await limiter.acquire()
+    await limiter.release(0.1, overload=True)
+    assert int(limiter.limit) == 5
+
+    await limiter.acquire()
+    await limiter.release(1, overload=False)
+    await limiter.acquire()
+    await limiter.release(1, overload=False)
+    assert int(limiter.limit) == 2
+    assert limiter.inflight == 0
+
+
+@patch("prozorro_bridge_competitivedialogue.limiter.LOGGER", MagicMock())
+def test_adaptive_limiter_recovers_after_latency_shift():
+    limiter = AdaptiveLimiter(min_limit=5, max_limit=50, initial=20, window=10)
+
+    def run_window(latency):
+        limiter.latencies = [latency] * limiter.window
+        limiter.max_inflight = int(limiter.limit)
+        limiter.update()
+
+    for _ in range(20):
+        run_window(0.1)
+    assert int(limiter.limit) == 40
+    run_window(0.2)
+    assert int(limiter.limit) == 28
+    for _ in range(100):
+        run_window(0.2)
+    # the API got slower for good, the baseline follows it and the limit grows again
+    assert limiter.baseline == pytest.approx(0.2, rel=0.01)
+    assert int(limiter.limit) == 50
+
+
+@pytest.mark.asyncio
+async def test_limited_session_reads_body_under_limit():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, initial=1, window=100)
+    response = MagicMock(status=200)
+
+    async def read():
+        assert limiter.inflight == 1
+        return b"{}"
+
+    response.read = read
+    session = LimitedSession(MagicMock(get=AsyncMock(return_value=response)), limiter)
+    assert await session.get("url") is response
+    assert limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_limited_session_waits_for_limit():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, initial=1, window=100)
+    release = asyncio.Event()
+
+    async def get(url, **kwargs):
+        await release.wait()
+        return MagicMock(status=200, read=AsyncMock(return_value=b"{}"))
+
+    session = LimitedSession(MagicMock(get=get), limiter)
+    first = asyncio.ensure_future(session.get("first"))
+    second = asyncio.ensure_future(session.get("second"))
+    await asyncio.sleep(0)
+    assert limiter.inflight == 1
+    release.set()
+    await asyncio.gather(first, second)
+    assert limiter.inflight == 0
+    assert len(limiter.latencies) == 2
+
+
+@pytest.mark.asyncio
+async def test_status_endpoints():
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[MagicMock(status=200), ConnectionError()])
+    app = status.create_app(session_mock)
+    monitoring.record_feed_page([{"id": "33", "dateModified": "2021-01-01T00:00:00+02:00"}])
+
+    with track_dialogue("33"), step_timer("get_tender", "33"):
+        response = await status.status(MagicMock(app=app))
+        data = json.loads(response.body)
+        assert data["inflight"][0]["id"] == "33"
+        assert data["inflight"][0]["step"] == "get_tender"
+        assert data["feed"]["last_id"] == "33"
+
+        assert (await status.liveness(MagicMock(app=app))).status == 200
+        with patch("prozorro_bridge_competitivedialogue.status.STATUS_STALL_TIMEOUT", -1):
+            assert (await status.liveness(MagicMock(app=app))).status == 503
+
+    with patch("prozorro_bridge_competitivedialogue.status.MONGODB_URL", ""):
+        assert (await status.readiness(MagicMock(app=app))).status == 200
+        response = await status.readiness(MagicMock(app=app))
+    assert response.status == 503
+    assert json.loads(response.body) == {"api": False}
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.ERROR_INTERVAL", 0.01)
+async def test_liveness_during_api_outage():
+    from prozorro_bridge_competitivedialogue.bridge import get_tender
+
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=ConnectionError())
+    with patch.object(monitoring, "LAST_PROGRESS", time.monotonic() - 100), \
+            patch("prozorro_bridge_competitivedialogue.status.STATUS_STALL_TIMEOUT", 50):
+        with track_dialogue("33"), step_timer("get_tender", "33"):
+            assert status.is_stalled()
+            task = asyncio.ensure_future(get_tender("33", session_mock))
+            await asyncio.sleep(0.05)
+            # the dialogue is stuck in the step, but the retries keep the instance alive
+            assert not status.is_stalled()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_dialog_add_stage2_id", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_new_tender_status", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.patch_dialog_status", AsyncMock())
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.utils.LOGGER", MagicMock())
+@patch("prozorro_bridge_competitivedialogue.shutdown.LOGGER", MagicMock())
+async def test_process_tender_stops_and_resumes_after_drain(tender_data, credentials):
+    from prozorro_bridge_competitivedialogue import bridge
+
+    tender_data["status"] = "active.stage2.waiting"
+    session_mock = AsyncMock()
+    session_mock.get = AsyncMock(side_effect=[
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps({"data": tender_data}))),
+        MagicMock(status=200, text=AsyncMock(return_value=json.dumps(credentials))),
+    ])
+    dialog = {"id": "33", "stage2TenderID": "34"}
+
+    async def create_tender_stage2(new_tender, session):
+        shutdown.DRAINING = True
+        return dialog
+
+    with patch.multiple(shutdown, DRAINING=False, CHECKPOINT={}):
+        with patch("prozorro_bridge_competitivedialogue.bridge.create_tender_stage2", create_tender_stage2):
+            await process_tender(session_mock, tender_data)
+        assert shutdown.CHECKPOINT["33"]["step"] == "patch_dialog_add_stage2_id"
+        assert shutdown.CHECKPOINT["33"]["dialog"] == dialog
+        assert bridge.patch_dialog_add_stage2_id.await_count == 0
+
+        shutdown.DRAINING = False
+        await process_tender(session_mock, tender_data)
+        assert shutdown.CHECKPOINT == {}
+
+    assert session_mock.get.await_count == 2
+    bridge.patch_dialog_add_stage2_id.assert_awaited_once_with(dialog, session_mock)
+    bridge.patch_new_tender_status.assert_awaited_once_with(dialog, session_mock)
+    bridge.patch_dialog_status.assert_awaited_once_with("33", session_mock)
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.shutdown.LOGGER", MagicMock())
+async def test_drain_saves_checkpoint(tmp_path):
+    async def worker(session, tender):
+        with track_dialogue(tender["id"], tender):
+            INFLIGHT[tender["id"]]["dialog"] = {"id": tender["id"], "stage2TenderID": "34"}
+            with step_timer("patch_new_tender_status", tender["id"]):
+                await asyncio.sleep(10)
+
+    scheduler = PriorityScheduler(worker, concurrency=1)
+    scheduler.submit(None, {"id": "33"})
+    scheduler.submit(None, {"id": "36"})
+    await asyncio.sleep(0)
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    with patch.multiple(shutdown, DRAINING=False, CHECKPOINT={}, DRAIN_CHECKPOINT_FILE=checkpoint_file):
+        await shutdown.drain(scheduler, timeout=0.1)
+        entries = {entry["tender"]["id"]: entry for entry in shutdown.load_checkpoint()}
+        assert list(entries) == ["36", "33"]
+        assert entries["33"]["step"] == "patch_new_tender_status"
+        assert entries["36"]["step"] == shutdown.STEP_PROCESS
+    assert INFLIGHT == {}
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.shutdown.LOGGER", MagicMock())
+async def test_drain_stops_workers_before_saving(tmp_path):
+    created = []
+
+    async def worker(session, tender):
+        with track_dialogue(tender["id"], tender):
+            with step_timer("create_tender_stage2", tender["id"]):
+                await asyncio.sleep(0.2)
+                created.append(tender["id"])
+            shutdown.should_stop(tender, "patch_dialog_add_stage2_id", {"id": "33", "stage2TenderID": "34"})
+
+    def slow_save(entries):
+        time.sleep(0.3)
+        save_checkpoint(entries)
+
+    save_checkpoint = shutdown.save_checkpoint
+    scheduler = PriorityScheduler(worker, concurrency=1)
+    scheduler.submit(None, {"id": "33"})
+    await asyncio.sleep(0)
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    with patch.multiple(shutdown, DRAINING=False, CHECKPOINT={}, MONGODB_URL="",
+                        DRAIN_CHECKPOINT_FILE=checkpoint_file, save_checkpoint=slow_save):
+        await shutdown.drain(scheduler, timeout=0.05)
+        await asyncio.sleep(0.2)
+        # stage 2 isn't created after the snapshot, the saved entry is the last state
+        assert created == []
+        assert shutdown.load_checkpoint() == list(shutdown.CHECKPOINT.values())
+        assert shutdown.CHECKPOINT["33"]["step"] == shutdown.STEP_PROCESS
+
+
+@pytest.mark.asyncio
+async def test_resume_keeps_checkpoint_until_finished(tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    submitted = {}
+
+    def submit(tender):
+        submitted[tender["id"]] = asyncio.get_event_loop().create_future()
+        return submitted[tender["id"]]
+
+    entries = [
+        {"tender": {"id": "33"}, "step": "patch_dialog_status", "dialog": {"id": "33", "stage2TenderID": "34"}},
+        {"tender": {"id": "36"}, "step": shutdown.STEP_PROCESS, "dialog": None},
+    ]
+    with patch.multiple(shutdown, DRAINING=False, CHECKPOINT={}, RESUMING=set(),
+                        MONGODB_URL="", DRAIN_CHECKPOINT_FILE=checkpoint_file):
+        shutdown._write_file(entries)
+        assert await shutdown.resume(submit) == 2
+        assert await shutdown.resume(submit) == 0
+        assert shutdown.CHECKPOINT["33"]["step"] == "patch_dialog_status"
+
+        submitted["33"].set_result(None)
+        submitted["36"].set_result(None)
+        # a crash before the dialogues are finished resumes them again
+        assert len(shutdown.load_checkpoint()) == 2
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+        assert shutdown.load_checkpoint() == []
+        assert shutdown.RESUMING == set()
+
+
+def test_checkpoint_mongodb():
+    collection = MagicMock()
+    collection.find.return_value = [{"_id": "33", "tender": {"id": "33"}, "step": "process_tender", "dialog": None}]
+    entry = {"tender": {"id": "33"}, "step": "process_tender", "dialog": None}
+    with patch.multiple(shutdown, MONGODB_URL="mongodb://mongo", INSTANCE_ID="pod-1", _collection=collection):
+        shutdown.save_checkpoint([entry])
+        assert shutdown.load_checkpoint() == [entry]
+        shutdown.remove_checkpoint(["33"])
+    collection.replace_one.assert_called_once_with({"_id": "33"}, dict(entry, _id="33"), upsert=True)
+    collection.delete_many.assert_called_once_with({"_id": {"$in": ["33"]}, "owner": "pod-1"})
+
+
+def test_checkpoint_mongodb_claims_entries():
+    entry = {"tender": {"id": "33"}, "step": "process_tender", "dialog": None}
+    collection = MagicMock()
+    collection.find_one_and_update.side_effect = [dict(entry, _id="33", owner=None), None]
+    with patch.multiple(shutdown, MONGODB_URL="mongodb://mongo", INSTANCE_ID="pod-1", _collection=collection):
+        assert shutdown.claim_checkpoint() == [entry]
+        shutdown.renew_claims(["33"])
+    query, update = collection.find_one_and_update.call_args[0]
+    # free entries and the ones whose owner stopped renewing the claim
+    assert query["$or"][0] == {"owner": None}
+    assert "claimed" in query["$or"][1]
+    assert update["$set"]["owner"] == "pod-1"
+    query, update = collection.update_many.call_args[0]
+    assert query == {"_id": {"$in": ["33"]}, "owner": "pod-1"}
+
+
+def test_validate_settings():
+    assert settings.validate_settings() == []
+    with patch.multiple(settings, LIMITER_BACKOFF=1.5, SCHEDULER_CONCURRENCY=0, TRACE_EXPORTER="jaeger"):
+        errors = settings.validate_settings()
+    assert errors == [
+        "SCHEDULER_CONCURRENCY should be positive",
+        "LIMITER_BACKOFF should be between 0 and 1",
+        "TRACE_EXPORTER should be one of: console, file",
+    ]
+
+
+def test_validate_settings_parse_errors():
+    with patch.dict(os.environ, {"ERROR_INTERVAL": "abc", "LOOP_LAG_THRESHOLD": "0.1s"}):
+        importlib.reload(settings)
+    try:
+        assert settings.ERROR_INTERVAL == 5
+        assert settings.validate_settings() == [
+            "ERROR_INTERVAL should be an integer, got 'abc'",
+            "LOOP_LAG_THRESHOLD should be a number, got '0.1s'",
+        ]
+    finally:
+        importlib.reload(settings)
+    assert settings.validate_settings() == []
+
+
+def test_time_to_first_dialogue():
+    metrics.reset()
+    with patch.multiple(monitoring, FIRST_DIALOGUE_PROCESSED=False, process_uptime=MagicMock(side_effect=[1.5, 2.5])):
+        with track_dialogue("33"):
+            pass
+        with track_dialogue("34"):
+            pass
+    assert metrics.get_gauge("time_to_first_dialogue_seconds") == 1.5
+    assert monitoring.process_uptime() > 0
+
+
+def test_parse_importtime():
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   json.scanner\n"
+        "import time:      2000 |       2120 | prozorro_bridge_competitivedialogue.main\n"
+    )
+    assert import_time.parse_importtime(output) == {
+        "json.scanner": (120, 120),
+        "prozorro_bridge_competitivedialogue.main": (2000, 2120),
+    }
+
+
+def test_main_defers_optional_imports():
+    modules = import_time.measure()
+    deferred = ["sqlite3"] + [
+        f"prozorro_bridge_competitivedialogue.{name}"
+        for name in ("dry_run", "recorder", "status", "config", "profiler", "reconcile")
+    ]
+    assert [name for name in deferred if name in modules] == []
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER", MagicMock())
+async def test_create_tender_stage2_gzip(tender_data):
+    metrics.reset()
+    session_mock = AsyncMock()
+    session_mock.post = AsyncMock(side_effect=[
+        MagicMock(
+            status=201,
+            headers={"Content-Length": "120"},
+            text=AsyncMock(return_value=json.dumps({"data": {"id": "34", "dialogueID": tender_data["id"]}})),
+        )
+    ])
+    with patch.multiple(utils, REQUEST_GZIP=True, REQUEST_GZIP_MIN_SIZE=10):
+        await create_tender_stage2(dict(tender_data, dialogueID=tender_data["id"]), session_mock)
+
+    kwargs = session_mock.post.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(kwargs["data"]))["data"]["dialogueID"] == tender_data["id"]
+    assert recorder.get_request_json(kwargs)["data"]["dialogueID"] == tender_data["id"]
+    assert metrics.get_counter("request_bytes_total", operation="create_tender_stage2") == len(kwargs["data"])
+    assert metrics.get_counter("response_bytes_total", operation="create_tender_stage2") == 120
+
+
+def test_encode_body_small():
+    with patch.multiple(utils, REQUEST_GZIP=True, REQUEST_GZIP_MIN_SIZE=1024):
+        request = utils.encode_body({"status": "active"})
+    assert request == {"data": b'{"data": {"status": "active"}}', "headers": utils.HEADERS}
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.bridge.LOGGER")
+async def test_create_tender_stage2_metrics_error(mocked_logger, tender_data):
+    session_mock = AsyncMock()
+    session_mock.post = AsyncMock(side_effect=[
+        MagicMock(
+            status=201,
+            headers={"Content-Length": "invalid"},
+            text=AsyncMock(return_value=json.dumps({"data": {"id": "34", "dialogueID": tender_data["id"]}})),
+        )
+    ])
+    dialog = await create_tender_stage2(dict(tender_data, dialogueID=tender_data["id"]), session_mock)
+
+    assert dialog == {"id": tender_data["id"], "stage2TenderID": "34"}
+    assert session_mock.post.await_count == 1
+    assert mocked_logger.exception.call_count == 0
+
+
+@patch("prozorro_bridge_competitivedialogue.config.LOGGER", MagicMock())
+def test_config_reload(tmp_path):
+    import prozorro_bridge_competitivedialogue.bridge as bridge
+
+    metrics.reset()
+    config_file = tmp_path / "bridge.env"
+    scheduler = PriorityScheduler(AsyncMock())
+    limiter = AdaptiveLimiter(min_limit=5, max_limit=200, initial=150)
+    config_file.write_text("ERROR_INTERVAL=1\nREWRITE_STATUSES=draft, draft.pending\nLIMITER_MAX=100\n")
+    try:
+        with patch.object(config, "_mtime", None):
+            config.check(str(config_file), scheduler, limiter)
+        assert bridge.ERROR_INTERVAL == settings.ERROR_INTERVAL == 1
+        assert bridge.REWRITE_STATUSES == ("draft", "draft.pending")
+        assert limiter.max_limit == limiter.limit == 100
+        assert metrics.get_counter("config_reloads_total", result="applied") == 1
+        assert metrics.get_gauge("config_value", setting="ERROR_INTERVAL") == 1
+
+        config_file.write_text("ERROR_INTERVAL=0\n")
+        assert config.reload(str(config_file), scheduler, limiter) is False
+        config_file.write_text("API_TOKEN=token\n")
+        assert config.reload(str(config_file), scheduler, limiter) is False
+        assert bridge.ERROR_INTERVAL == settings.ERROR_INTERVAL == 1
+        assert metrics.get_counter("config_reloads_total", result="invalid") == 2
+    finally:
+        config.apply(config.DEFAULTS)
+    assert bridge.REWRITE_STATUSES == ("draft",)
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.config.LOGGER", MagicMock())
+async def test_config_watch_survives_bad_files(tmp_path):
+    metrics.reset()
+    config_file = tmp_path / "bridge.json"
+    for content in ('["x"]', '{"ALLOWED_STATUSES": [1]}'):
+        config_file.write_text(content)
+        assert config.reload(str(config_file)) is False
+
+    with patch.object(config, "check", MagicMock(side_effect=[AttributeError("bug"), None, asyncio.CancelledError])):
+        with patch("asyncio.get_event_loop", MagicMock()), patch("asyncio.sleep", AsyncMock()):
+            with pytest.raises(asyncio.CancelledError):
+                await config.watch(path=str(config_file))
+        assert config.check.call_count == 3
+    assert metrics.get_counter("config_reloads_total", result="invalid") == 3
+
+
+@pytest.mark.asyncio
+async def test_priority_scheduler_resize():
+    worker = AsyncMock()
+    scheduler = PriorityScheduler(worker, concurrency=2)
+    await scheduler.submit(None, {"id": "33"})
+    scheduler.resize(4)
+    assert len(scheduler.workers) == 4
+    scheduler.resize(1)
+    await asyncio.gather(*(scheduler.submit(None, {"id": str(i)}) for i in range(6)))
+    assert len(scheduler.workers) == 1
+    assert worker.await_count == 7
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+@patch("prozorro_bridge_competitivedialogue.profiler.LOGGER", MagicMock())
+async def test_profiler_capture(tmp_path):
+    async def busy_step():
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            json.dumps({"data": list(range(100))})
+
+    metrics.reset()
+    capture = asyncio.ensure_future(profiler.capture(0.1, str(tmp_path)))
+    await asyncio.sleep(0)
+    await busy_step()
+    paths = await capture
+
+    with open(paths["cpu"]) as f:
+        assert any("busy_step" in line for line in f)
+    with open(paths["summary"]) as f:
+        summary = f.read()
+    assert "busy_step" in summary and "Bridge functions by total time" in summary
+    assert tracemalloc.Snapshot.load(paths["memory"]).traces
+    assert metrics.get_counter("profiles_total") == 1
+
+
+@pytest.mark.asyncio
+async def test_profile_endpoint():
+    request = MagicMock(query={"seconds": "5"})
+    with patch.object(profiler, "start", MagicMock(side_effect=[True, False])) as mocked_start:
+        assert (await status.profile(request)).status == 202
+        assert (await status.profile(request)).status == 409
+    mocked_start.assert_called_with(5.0)
+    assert (await status.profile(MagicMock(query={"seconds": "forever"}))).status == 400